@@ -1,98 +1,342 @@
-import benchmark
-import numpy as np
-
-from sparse_list import SparseList
-from sparse_vector import SparseVector
-
-
-class BenchmarkAbstract(benchmark.Benchmark):
-
-    each = 10            # number of runs
-    full_size = 1000000  # total size of sparse lists and vectors
-    data_size = 10000    # actual data size of sparse lists and vectors
-
-    def setUp(self):
-        # Can also specify tearDown, eachSetUp, and eachTearDown
-        self.a = np.random.rand(self.data_size)
-        self.k = np.arange(self.data_size)
-
-        self.sl = SparseList(dict(zip(self.k, self.a)))
-        self.sl.size = self.full_size
-
-        self.sv = SparseVector((self.k, self.a), size=self.full_size)
-
-
-class BenchmarkInit(BenchmarkAbstract):
-
-    def test_list_init(self):
-        sl = SparseList(self.full_size)
-
-    def test_vector_init(self):
-        sv = SparseVector(self.full_size)
-
-    def test_list_init_with_values(self):
-        sl = SparseList(dict(zip(self.k, self.a)))
-        sl.size = self.full_size
-
-    def test_vector_init_with_values(self):
-        sv = SparseVector((self.k, self.a), size=self.full_size)
-
+#!/usr/bin/env python
+"""
 
-class BenchmarkGet(BenchmarkAbstract):
+Benchmarks of `SparseVector`, swept over the size, the density and the
+default value of the vectors, timing each operation and measuring its peak
+memory. Results are printed as a table and may be saved as JSON, and then
+compared against a previously saved baseline to catch regressions :
 
-    def test_list_get_with_iterable_in_slice(self):
-        dummy = self.sl[self.k]
+    $ python benchmark_sparse_vector.py --save baseline.json
+    $ python benchmark_sparse_vector.py --compare baseline.json
 
-    def test_vector_get_with_iterable_in_slice(self):
-        dummy = self.sv[self.k]
+Run with `--help` for the available options.
 
+"""
 
-class BenchmarkSet(BenchmarkAbstract):
+from __future__ import print_function
 
-    def test_list_set_with_iterables_in_slice_absent(self):
-        sl = SparseList(self.full_size)
-        sl[self.k] = self.a
+import argparse
+import json
+import pickle
+import platform
+import sys
+import time
+import timeit
 
-    def test_list_set_with_iterables_in_slice_present(self):
-        self.sl[self.k] = self.a
-
-    def test_vector_set_with_iterables_in_slice_absent(self):
-        sv = SparseVector(self.full_size)
-        sv[self.k] = self.a
-
-    def test_vector_set_with_iterables_in_slice_present(self):
-        self.sv[self.k] = self.a
-
-
-class BenchmarkDensify(BenchmarkAbstract):
-
-    def test_list_densify_with_list(self):
-        list(self.sl)
-
-    def test_vector_densify_with_list(self):
-        list(self.sv)
-
-    def test_vector_densify_with_numpy(self):
-        np.array(self.sv)
-
-    def test_vector_densify_with_densify(self):
-        self.sv.densify()
-
-
-class BenchmarkIterate(BenchmarkAbstract):
-
-    def test_list_iterate(self):
-        for k, v in enumerate(self.sl):
-            pass
+import numpy as np
 
-    def test_vector_iterate(self):
-        for k, v in enumerate(self.sv):
-            pass
+from sparse_vector import SparseVector
 
-    def test_vector_iterate_sparsely(self):
-        for k, v in enumerate(self.sv.iter()):
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+def random_indices(size, count, clustering=0., rng=np.random):
+    """
+    Return `count` sorted and unique random indices in `[0, size)`.
+    With a `clustering` in `[0, 1)`, indices come in runs whose mean length
+    is `1 / (1 - clustering)` : 0 spreads them uniformly, 0.99 makes runs of
+    about a hundred indices.
+    """
+    count = min(int(count), int(size))
+    if count == 0:
+        return np.array([], dtype=np.int)
+    runs = max(1, int(round(count * (1. - clustering))))
+    lengths = rng.multinomial(count - runs, np.ones(runs) / runs) + 1
+    gaps = rng.multinomial(size - count, np.ones(runs + 1) / (runs + 1))
+    starts = np.cumsum(gaps[:-1]) + np.cumsum(lengths) - lengths
+    offsets = np.arange(count) - np.repeat(np.cumsum(lengths) - lengths,
+                                           lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def random_sparse_vector(size, density, clustering=0., dtype=np.float,
+                         default_value=0, seed=None):
+    """
+    Return a random `SparseVector` of `size` with `density * size` values,
+    made of random floats in `[0, 1)` or of random integers in `[1, 100)`.
+    The same `seed` always gives the same vector.
+    """
+    rng = np.random.RandomState(seed)
+    indices = random_indices(size, round(size * density), clustering, rng)
+    if np.issubdtype(dtype, np.integer):
+        values = rng.randint(1, 100, indices.size).astype(dtype)
+    else:
+        values = rng.random_sample(indices.size).astype(dtype)
+    sv = SparseVector(int(size), default_value=default_value, dtype=dtype)
+    sv.indices = indices
+    sv.values = values
+    return sv
+
+
+# Each case is given a fresh vector and a seeded random state, and returns
+# the function to time. The preparation it does is not timed.
+CASES = {}
+
+
+def case(name):
+    def register(prepare):
+        CASES[name] = prepare
+        return prepare
+    return register
+
+
+@case('get')
+def prepare_get(sv, rng):
+    positions = rng.randint(0, len(sv), 1000)
+    return lambda: [sv[i] for i in positions]
+
+
+@case('set')
+def prepare_set(sv, rng):
+    positions = rng.randint(0, len(sv), 1000)
+
+    def run():
+        for i in positions:
+            sv[i] = 1
+    return run
+
+
+@case('set_batch')
+def prepare_set_batch(sv, rng):
+    positions = random_indices(len(sv), max(1, sv.indices.size // 10),
+                               rng=rng)
+    values = rng.random_sample(positions.size)
+
+    def run():
+        sv[positions] = values
+    return run
+
+
+@case('delete')
+def prepare_delete(sv, rng):
+    positions = rng.permutation(sv.indices)[:100]
+
+    def run():
+        for i in positions:
+            del sv[i]
+    return run
+
+
+@case('slice')
+def prepare_slice(sv, rng):
+    windows = rng.randint(0, len(sv), (100, 2))
+    windows.sort(axis=1)
+    return lambda: [sv[a:b] for a, b in windows]
+
+
+@case('iterate')
+def prepare_iterate(sv, rng):
+    def run():
+        for _ in sv:
             pass
+    return run
+
+
+@case('densify')
+def prepare_densify(sv, rng):
+    return sv.densify
+
+
+@case('accumulate')
+def prepare_accumulate(sv, rng):
+    positions = rng.randint(0, len(sv), max(1, sv.indices.size))
+    values = rng.random_sample(positions.size)
+    return lambda: sv.accumulate(positions, values)
+
+
+@case('dot')
+def prepare_dot(sv, rng):
+    other = random_sparse_vector(len(sv), float(sv.indices.size) / len(sv),
+                                 seed=rng.randint(2 ** 31))
+    return lambda: sv.dot(other)
+
+
+@case('arithmetic')
+def prepare_arithmetic(sv, rng):
+    other = random_sparse_vector(len(sv), float(sv.indices.size) / len(sv),
+                                 seed=rng.randint(2 ** 31))
+    return lambda: (sv.lazy() * 2. + other).clip(0.5).compute()
+
+
+@case('reduce_bins')
+def prepare_reduce_bins(sv, rng):
+    return lambda: sv.reduce_bins(64, 'mean')
+
+
+@case('cumsum')
+def prepare_cumsum(sv, rng):
+    return sv.cumsum
+
+
+@case('pickle')
+def prepare_pickle(sv, rng):
+    return lambda: pickle.loads(pickle.dumps(sv, pickle.HIGHEST_PROTOCOL))
+
+
+def measure(prepare, size, density, default, clustering, repeat, seed):
+    """
+    Return the best and median times of `repeat` runs of a case, in seconds,
+    and the peak memory allocated by one run, in bytes.
+    """
+    def fresh():
+        sv = random_sparse_vector(size, density, clustering,
+                                  default_value=default, seed=seed)
+        return prepare(sv, np.random.RandomState(seed + 1))
+
+    times = []
+    for _ in range(repeat):
+        run = fresh()
+        start = timeit.default_timer()
+        run()
+        times.append(timeit.default_timer() - start)
+
+    peak = None
+    if tracemalloc is not None:
+        run = fresh()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+
+def run_benchmarks(cases, sizes, densities, defaults, clustering=0.,
+                   repeat=5, seed=42, report=None):
+    """
+    Run the given `cases` over the grid of `sizes`, `densities` and
+    `defaults`, and return the results as a JSON-serializable `dict`.
+    `report`, when given, is called with each result as soon as it is known.
+    """
+    results = []
+    for name in cases:
+        for size in sizes:
+            for density in densities:
+                for default in defaults:
+                    best, median, peak = measure(
+                        CASES[name], size, density, default, clustering,
+                        repeat, seed)
+                    result = {
+                        'case': name,
+                        'size': size,
+                        'density': density,
+                        'default': default,
+                        'clustering': clustering,
+                        'best': best,
+                        'median': median,
+                        'peak_bytes': peak,
+                    }
+                    results.append(result)
+                    if report is not None:
+                        report(result)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def _key(result):
+    return (result['case'], result['size'], result['density'],
+            result['default'], result['clustering'])
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Return the `(result, baseline_result, ratio)` of the results whose best
+    time is slower than in the baseline by more than `tolerance`.
+    """
+    previous = dict((_key(r), r) for r in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        old = previous.get(_key(result))
+        if old is None or not old['best']:
+            continue
+        ratio = result['best'] / old['best']
+        if ratio > 1. + tolerance:
+            regressions.append((result, old, ratio))
+    return regressions
+
+
+def _print_result(result):
+    peak = result['peak_bytes']
+    print('| {:<12} | {:>11} | {:>8} | {:>7} | {:>12.4g} | {:>12.4g} | {:>12}'
+          ' |'.format(result['case'], result['size'], result['density'],
+                      result['default'], result['best'], result['median'],
+                      '-' if peak is None else peak))
+    sys.stdout.flush()
+
+
+def _floats(text):
+    return [float(t) for t in text.split(',')]
+
+
+def _ints(text):
+    return [int(float(t)) for t in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        '\n\n')[0], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(sorted(CASES)),
+                        help='comma-separated cases to run, among %(default)s')
+    parser.add_argument('--sizes', type=_ints, default=[10 ** 4, 10 ** 6],
+                        help='comma-separated sizes, like 1e4,1e6')
+    parser.add_argument('--densities', type=_floats, default=[.001, .01],
+                        help='comma-separated densities, like 0.001,0.01')
+    parser.add_argument('--defaults', type=_floats, default=[0.],
+                        help='comma-separated default values, like 0,1')
+    parser.add_argument('--clustering', type=float, default=0.,
+                        help='from 0 (uniform) to 0.99 (long runs)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed runs of each case')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', metavar='JSON',
+                        help='save the results to this file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare the results with this baseline file')
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help='slowdown ratio over the baseline that counts '
+                             'as a regression')
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(',')
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error('unknown cases: {}'.format(', '.join(sorted(unknown))))
+
+    print('| case         |        size |  density | default |     best (s) |'
+          '   median (s) |   peak bytes |')
+    print('|--------------|-------------|----------|---------|--------------|'
+          '--------------|--------------|')
+    results = run_benchmarks(cases, args.sizes, args.densities,
+                             args.defaults, clustering=args.clustering,
+                             repeat=args.repeat, seed=args.seed,
+                             report=_print_result)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for result, old, ratio in regressions:
+            print('REGRESSION {case} size={size} density={density} '
+                  'default={default}: '.format(**result) +
+                  '{:.4g}s -> {:.4g}s (x{:.2f})'.format(
+                      old['best'], result['best'], ratio))
+        return 1 if regressions else 0
+    return 0
 
 
 if __name__ == '__main__':
-    benchmark.main(format="markdown", numberFormat="%.4g")
+    sys.exit(main())
@@ -23,7 +23,10 @@ except (ImportError, OSError):
 
 setup(
     name='sparse_vector',
-    py_modules=['sparse_vector'],
+    py_modules=['sparse_vector', 'sparse_vector_blocks',
+                'sparse_vector_hashing', 'sparse_vector_lazy',
+                'sparse_vector_cache', 'sparse_vector_shared',
+                'sparse_vector_store'],
     version=version,
     description='A sparse vector in pure python, based on numpy.',
     author=paj,
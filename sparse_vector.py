@@ -8,15 +8,323 @@ of memory efficiency you don't wish to store these. cf. Sparse array:
 
 """
 
+import hashlib
+import struct
+import warnings
+from contextlib import contextmanager
+from functools import wraps
+
 import numpy as np
 from future.builtins import range
 from six.moves import zip_longest
 
 
+class DensifyError(MemoryError):
+    """
+    Raised in strict mode when an operation would allocate more memory than
+    allowed in order to densify a vector.
+    """
+
+
+class DensifyWarning(RuntimeWarning):
+    """
+    Warned in strict mode when an operation would allocate more memory than
+    allowed in order to densify a vector.
+    """
+
+
+class _Instrumentation(object):
+    """
+    The per-process counters of the costly operations of all vectors, and
+    the settings of the strict mode. Counting is off by default, and then
+    costs a single attribute lookup on the hot paths.
+    """
+
+    COUNTERS = (
+        'densify_calls',      # number of dense arrays of `size` allocated
+        'densify_bytes',      # total bytes of these dense arrays
+        'reallocations',      # number of rebuilds of the internal arrays
+        'reallocated_bytes',  # total bytes of these rebuilt arrays
+        'lookups',            # number of binary searches of one position
+        'scans',              # number of linear scans of the values
+    )
+
+    def __init__(self):
+        self.enabled = False
+        self.max_bytes = None
+        self.action = 'raise'
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def check_dense_allocation(self, nbytes, what):
+        if self.enabled:
+            self.count('densify_calls')
+            self.count('densify_bytes', nbytes)
+        if self.max_bytes is None or nbytes <= self.max_bytes:
+            return
+        message = '{} would allocate {} bytes, over the limit of {}'.format(
+            what, nbytes, self.max_bytes)
+        if self.action == 'warn':
+            warnings.warn(message, DensifyWarning, stacklevel=4)
+        else:
+            raise DensifyError(message)
+
+
+_instrumentation = _Instrumentation()
+
+
+def stats():
+    """
+    Return a copy of the per-process counters of the costly operations of
+    all vectors, as a `dict`. They only count while enabled, with
+    `enable_stats()` or within `track()`.
+    """
+    return dict(_instrumentation.counters)
+
+
+def reset_stats():
+    """
+    Set all the per-process counters back to zero.
+    """
+    _instrumentation.counters = dict.fromkeys(_Instrumentation.COUNTERS, 0)
+
+
+def enable_stats(enabled=True):
+    """
+    Start, or stop, counting the costly operations of all vectors.
+    """
+    _instrumentation.enabled = enabled
+
+
+@contextmanager
+def track():
+    """
+    Count the costly operations of all vectors within this block, and yield
+    a `dict` that is filled with their counts when the block exits :
+
+        with track() as counts:
+            do_something(sv)
+        assert counts['densify_calls'] == 0
+    """
+    was_enabled = _instrumentation.enabled
+    before = stats()
+    counts = {}
+    _instrumentation.enabled = True
+    try:
+        yield counts
+    finally:
+        _instrumentation.enabled = was_enabled
+        after = stats()
+        counts.update((k, after[k] - before[k]) for k in after)
+
+
+def set_strict(max_bytes, action='raise'):
+    """
+    Make any operation that densifies a vector into more than `max_bytes`
+    either 'raise' a `DensifyError` or 'warn' a `DensifyWarning`.
+    A `max_bytes` of None allows any size again.
+    """
+    assert action in ('raise', 'warn'), "The action is 'raise' or 'warn'."
+    _instrumentation.max_bytes = max_bytes
+    _instrumentation.action = action
+
+
+@contextmanager
+def strict(max_bytes=0, action='raise'):
+    """
+    Within this block, make any operation that densifies a vector into more
+    than `max_bytes` either 'raise' or 'warn'. See `set_strict()`.
+    """
+    previous = _instrumentation.max_bytes, _instrumentation.action
+    set_strict(max_bytes, action)
+    try:
+        yield
+    finally:
+        set_strict(*previous)
+
+
+def _is_expression(other):
+    """
+    Whether `other` is a lazy expression, with which the list-like `+` and
+    `*` of vectors give way to elementwise arithmetic.
+    """
+    from sparse_vector_lazy import Expression
+    return isinstance(other, Expression)
+
+
+_REDUCTIONS = ('sum', 'mean', 'max', 'min', 'count')
+
+_ACCUMULATORS = {
+    'add': np.add,
+    'max': np.maximum,
+    'min': np.minimum,
+}
+
+
+def _memoized(method):
+    """
+    Remember the result of a `SparseVector` method without arguments until
+    the vector changes, as told by its `version`.
+    """
+    name = method.__name__
+
+    @wraps(method)
+    def memoized(self):
+        self.flush()
+        if self._memo_version != self._version:
+            self._memo = {}
+            self._memo_version = self._version
+        if name not in self._memo:
+            self._memo[name] = method(self)
+        return self._memo[name]
+    return memoized
+
+
+def _in_threads(compute, d, workers=None):
+    """
+    Return `compute(start, stop)` over the range `[0, d)` of the last axis of
+    the result, split among a pool of `workers` threads when given. numpy
+    releases the GIL in its products, so that the parts run in parallel.
+    """
+    if not workers or workers < 2 or d < 2 * workers:
+        return compute(0, d)
+    from multiprocessing.pool import ThreadPool
+    bounds = np.linspace(0, d, workers + 1).astype(np.int)
+    pool = ThreadPool(workers)
+    try:
+        parts = pool.map(lambda ab: compute(*ab), zip(bounds[:-1], bounds[1:]))
+    finally:
+        pool.close()
+    return np.concatenate(parts, axis=-1)
+
+
+def _segment_sums(rows, indptr, axis=0):
+    """
+    Return the sums of the segments `[indptr[i], indptr[i + 1])` of `rows`
+    along `axis`, zero for the empty ones.
+    """
+    shape = list(rows.shape)
+    shape[axis] = indptr.size - 1
+    sums = np.zeros(shape, dtype=rows.dtype)
+    filled = indptr[1:] > indptr[:-1]
+    if filled.any():
+        reduced = np.add.reduceat(rows, indptr[:-1][filled], axis=axis)
+        if axis == 0:
+            sums[filled] = reduced
+        else:
+            sums[:, filled] = reduced
+    return sums
+
+
+def dot_sparse(W, sv, sums=None, workers=None):
+    """
+    Return the product `W @ sv` of the dense matrix `W`, of shape `(d, n)`,
+    with the `SparseVector` `sv` of size `n`, as an array of `d` values.
+    Only the columns of `W` at the stored indices are read, in O(nnz * d).
+    With a `SparseVectorBatch`, return the products with each of its vectors
+    as the rows of an array of shape `(len(batch), d)`.
+
+    sums : array_like, optional
+        The row sums of `W`, needed when the default value is not zero,
+        and computed when not given. Precompute them to reuse `W`.
+    workers : int, optional
+        Split the `d` rows of `W` among that many threads.
+    """
+    W = np.asarray(W)
+    assert W.ndim == 2 and W.shape[1] == sv.size, \
+        "You can only multiply a matrix of {} columns.".format(sv.size)
+    indices, coefficients = sv.indices, sv.values - sv.default
+    if isinstance(sv, SparseVectorBatch):
+        def compute(a, b):
+            columns = W[a:b][:, indices] * coefficients
+            return _segment_sums(columns, sv.indptr, axis=1).T
+    else:
+        def compute(a, b):
+            return np.dot(W[a:b][:, indices], coefficients)
+    result = _in_threads(compute, W.shape[0], workers)
+    if sv.default != 0:
+        result = result + sv.default * (W.sum(axis=1) if sums is None
+                                        else np.asarray(sums))
+    return result
+
+
+class WriteBuffer(object):
+    """
+    Stages the writes made to a `SparseVector` in a dict, and merges them into
+    its sorted arrays in one vectorized pass once `threshold` positions are
+    staged, or when a read needs the arrays.
+    Reading a single position looks into the staged writes and never merges.
+
+    threshold : int, optional
+        The number of staged positions that triggers a merge.
+        Batched writes at least this big skip the buffer altogether.
+    """
+
+    def __init__(self, threshold=1024):
+        self.threshold = int(threshold)
+        self.pending = {}
+        self.staged = 0       # number of writes staged so far
+        self.merges = 0       # number of merges into the sorted arrays
+        self.merged = 0       # number of positions merged so far
+        self.read_merges = 0  # number of merges forced by a read
+
+    def __len__(self):
+        return len(self.pending)
+
+    def stage(self, index, value):
+        self.pending[index] = value
+        self.staged += 1
+
+    def stage_many(self, indices, values):
+        self.pending.update(zip(indices.tolist(), values.tolist()))
+        self.staged += len(indices)
+
+    def is_full(self):
+        return len(self.pending) >= self.threshold
+
+    def drain(self):
+        """
+        Empty the buffer and return its `(indices, values)`, sorted.
+        """
+        indices = np.fromiter(self.pending.keys(), dtype=np.int,
+                              count=len(self.pending))
+        values = np.array(list(self.pending.values()))
+        self.pending = {}
+        self.merges += 1
+        self.merged += indices.size
+        order = np.argsort(indices)
+        return indices[order], values[order]
+
+    def stats(self):
+        """
+        Return the counters of this buffer as a `dict`.
+        """
+        return {
+            'threshold': self.threshold,
+            'pending': len(self.pending),
+            'staged': self.staged,
+            'merges': self.merges,
+            'merged': self.merged,
+            'read_merges': self.read_merges,
+        }
+
+
 class SparseVector(object):
     """
     This implementation has a similar interface to `numpy`'s `ndarray` but
     stores the indices and values in two `ndarray`s to preserve memory.
+    The indices are kept sorted and unique, so that lookups are binary
+    searches and batched writes are merges.
+
+    Slicing with a unit step returns a view of this vector that shares its
+    arrays, and both are copied on write. Use `copy()` for an actual copy.
+
+    Every change bumps the `version` of the vector, which the statistics
+    like `sum()` or `norm()` rely on to be computed once per version.
+    Writing straight into the arrays of `indices` and `values` is not
+    noticed. A vector may be made immutable with `freeze()`.
 
     default_value : numerical, optional
         The default value that fills most of this vector.
@@ -28,10 +336,17 @@ class SparseVector(object):
     """
 
     def __init__(self, arg, default_value=0, size=None, dtype=np.float):
+        self._version = 0
+        self._frozen = False
+        self._memo = {}
+        self._memo_version = None
         self.default = default_value
         self.dtype = dtype
-        self.indices = np.array([], dtype=np.int)
-        self.values = np.array([], dtype=self.dtype)
+        self.write_buffer = None
+        self._indices = np.array([], dtype=np.int)
+        self._values = np.array([], dtype=self.dtype)
+        self._offset = 0      # of the stored indices, for slice views
+        self._shared = False  # whether other vectors share the arrays
         if isinstance(arg, (int, float)):  # 1e6 is a float
             self.size = int(arg)
         elif isinstance(arg, dict):
@@ -43,98 +358,188 @@ class SparseVector(object):
         if size is not None:
             self.size = int(size)
 
+    def __setattr__(self, name, value):
+        if not name.startswith('_'):  # a change of the vector
+            if self.__dict__.get('_frozen'):
+                raise ValueError('This SparseVector is frozen, copy() it to '
+                                 'change it.')
+            self.__dict__['_version'] = self.__dict__.get('_version', 0) + 1
+        object.__setattr__(self, name, value)
+
+    @property
+    def version(self):
+        """
+        The number of changes of this vector so far.
+        """
+        return self._version
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        """
+        Make this vector immutable, and return it. Its arrays become
+        read-only, and its statistics are computed once and for all.
+        """
+        self.__flush()
+        self.__rebase()
+        self.write_buffer = None
+        self._indices = self._indices.view()
+        self._indices.setflags(write=False)
+        self._values = self._values.view()
+        self._values.setflags(write=False)
+        self._frozen = True
+        return self
+
+    @property
+    def indices(self):
+        """
+        The sorted positions of the stored values, as a `numpy.ndarray`.
+        """
+        self.__flush(read=True)
+        self.__rebase()
+        return self._indices
+
+    @indices.setter
+    def indices(self, indices):
+        self._indices = indices
+        self._offset = 0
+
+    @property
+    def values(self):
+        """
+        The stored values, in the order of `indices`, as a `numpy.ndarray`.
+        """
+        self.__flush(read=True)
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+
+    @property
+    def nbytes(self):
+        """
+        The bytes taken by the stored indices and values, like
+        `numpy.ndarray.nbytes`. Arrays shared with other vectors count for
+        each of them.
+        """
+        self.__flush(read=True)
+        return self._indices.nbytes + self._values.nbytes
+
     def __len__(self):
         return self.size
 
     def __setitem__(self, index, value):
         def _is_array(_v):
             return isinstance(_v, (list, np.ndarray))
-        is_array_value = _is_array(value)
 
         if _is_array(index):
-
-            new = np.setdiff1d(index, self.indices, assume_unique=False)
-            old = np.intersect1d(self.indices, index, assume_unique=False)
-
-            if old.size > 0:
-                internal_indices = self.__internal_indices_of_indices(old)
-
-                if internal_indices.size > 0:
-                    if is_array_value:
-                        ei = np.where(np.in1d(index, old))[0]
-                        val = np.array(value)[ei]
-                    else:
-                        val = value
-                    self.values[internal_indices] = val
-
-            if new.size > 0:
-                ei = np.where(np.in1d(index, new))[0]
-                only_new_values = []
-                if is_array_value:
-                    only_new_values = np.array(value)[ei]
-                new_indices = []
-                new_values = []
-                for k, v in enumerate(np.array(index)[ei]):
-                    if is_array_value:
-                        val = only_new_values[k]
-                    else:
-                        val = value
-                    new_indices.append(v)
-                    new_values.append(val)
-                    self.size = max(v + 1, self.size)
-
-                self.indices = np.append(self.indices, new_indices)
-                self.values = np.append(self.values, new_values)
-        else:
-            i = self.__internal_index_of_index(index)
-            if i is None:
-                self.indices = np.append(self.indices, [index])
-                self.values = np.append(self.values, [value])
+            indices = np.array(index, dtype=np.int)
+            if _is_array(value):
+                values = np.array(value)
             else:
-                self.values[i] = value
+                values = np.array([value]).repeat(indices.size)
+            if indices.size == 0:
+                return
+            self.size = max(int(indices.max()) + 1, self.size)
+            buffer = self.write_buffer
+            if buffer is not None and indices.size < buffer.threshold:
+                buffer.stage_many(indices, values)
+                if buffer.is_full():
+                    self.__flush()
+                return
+            self.__flush()
+            # keep the last write of each index
+            indices, last = np.unique(indices[::-1], return_index=True)
+            self.__merge(indices, values[::-1][last])
+        else:
+            if index < 0:
+                index += self.size
             self.size = max(index + 1, self.size)
+            buffer = self.write_buffer
+            if buffer is not None:
+                buffer.stage(index, value)
+                if buffer.is_full():
+                    self.__flush()
+                return
+            if _instrumentation.enabled:
+                _instrumentation.count('lookups')
+            self.__rebase()
+            k = np.searchsorted(self._indices, index)
+            if k < self._indices.size and self._indices[k] == index:
+                self.__merge(np.array([index]), np.array([value]))
+            else:
+                self.__insert(np.array([k]), np.array([index]),
+                              np.array([value]))
 
     def __getitem__(self, index):
-        try:  # [start:stop:step]
-            s = slice(index.start, index.stop, index.step).indices(self.size)
-            return [self[i] for i in range(*s)]
-        except AttributeError:
-            pass
+        if isinstance(index, slice):  # [start:stop:step]
+            start, stop, step = index.indices(self.size)
+            if step == 1:
+                return self.__view(start, max(start, stop))
+            return self.__strided(start, stop, step)
         try:  # [iterable]
             return [self[i] for i in index]
         except TypeError:
             pass
         i = slice(index).indices(self.size)[1]
-        k = np.where(self.indices == i)[0]
-        return self.values[k[0]] if k.size > 0 else self.default
+        if self.write_buffer is not None and i in self.write_buffer.pending:
+            return self.write_buffer.pending[i]
+        if _instrumentation.enabled:
+            _instrumentation.count('lookups')
+        i += self._offset
+        k = np.searchsorted(self._indices, i)
+        if k < self._indices.size and self._indices[k] == i:
+            return self._values[k]
+        return self.default
 
     def __delitem__(self, index):
+        self.__flush()
+        self.__rebase()
         try:
-            s = slice(index.start, index.stop, index.step).indices(self.size)
-            for j in range(*s):
-                i = self.__internal_index_of_index(j)
-                self.indices = np.delete(self.indices, i)
-                self.values = np.delete(self.values, i)
+            start, stop, step = slice(index.start, index.stop,
+                                      index.step).indices(self.size)
+            indices = self._indices
+            if step > 0:
+                lo, hi = np.searchsorted(indices, [start, stop])
+                distances = indices[lo:hi] - start
+            else:
+                lo, hi = np.searchsorted(indices, [stop, start], side='right')
+                distances = start - indices[lo:hi]
+            doomed = np.zeros(indices.size, dtype=np.bool_)
+            doomed[lo:hi] = distances % abs(step) == 0
+            self.__keep(~doomed)
         except AttributeError:
             i = self.__internal_index_of_index(index)
             if i is not None:
-                self.indices = np.delete(self.indices, i)
-                self.values = np.delete(self.values, i)
+                self.__delete(i)
 
     def __delslice__(self, start, stop):
-        for index in range(start, stop):
-            self.__delitem__(index)
+        self.__delitem__(slice(start, stop))
 
     def __iter__(self):
         return np.nditer(self.densify())
 
+    def __reversed__(self):
+        return iter(self[::-1])
+
+    def __array__(self, dtype=None):
+        dense = self.densify()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
     def __contains__(self, value):
+        if _instrumentation.enabled:
+            _instrumentation.count('scans')
         return value in self.values
 
     def __repr__(self):
         return '[{}]'.format(', '.join([str(e) for e in self]))
 
     def __add__(self, other):
+        if _is_expression(other):
+            return NotImplemented
         result = self[:]
         return result.__iadd__(other)
 
@@ -144,34 +549,185 @@ class SparseVector(object):
         return self
 
     def __initialise_from_dict(self, arg):
-        self.values = np.array(arg.values(), dtype=self.dtype)
-        self.indices = np.array(arg.keys(), dtype=np.int)
-        self.size = np.max(self.indices) + 1
+        self.__initialise_from_tuple((list(arg.keys()), list(arg.values())))
 
     def __initialise_from_tuple(self, arg):
         indices, values = arg
         assert len(indices) == len(values), \
             "You must provide a tuple of two vectors (indices, values),\n" \
             "and indices must be integers."
-        self.values = np.array(values, dtype=self.dtype)
-        self.indices = np.array(indices, dtype=np.int)
-        self.size = np.max(self.indices) + 1
+        values = np.array(values, dtype=self.dtype)
+        indices = np.array(indices, dtype=np.int)
+        # keep the last value of each index
+        self.indices, last = np.unique(indices[::-1], return_index=True)
+        self.values = values[::-1][last]
+        self.size = int(self._indices[-1]) + 1 if self._indices.size else 0
 
     def __initialise_from_iterable(self, arg):
         self.values = np.array(list(arg), dtype=self.dtype)
-        self.indices = np.arange(len(self.values), dtype=np.int)
-        self.size = len(self.values)
+        self.indices = np.arange(len(self._values), dtype=np.int)
+        self.size = len(self._values)
 
-    def __internal_indices_of_indices(self, indices):
-        return np.where(np.in1d(self.indices, indices))[0]
+    def __view(self, start, stop):
+        """
+        Return the positions `[start, stop)` of this vector as a new vector
+        sharing the arrays of this one, without copying them.
+        """
+        self.__flush(read=True)
+        lo, hi = np.searchsorted(self._indices, [start + self._offset,
+                                                 stop + self._offset])
+        view = SparseVector(stop - start, default_value=self.default,
+                            dtype=self.dtype)
+        view._indices = self._indices[lo:hi]
+        view._values = self._values[lo:hi]
+        view._offset = self._offset + start
+        view._shared = self._shared = True
+        return view
+
+    def __strided(self, start, stop, step):
+        """
+        Return a new vector holding the positions `range(start, stop, step)`.
+        """
+        indices, values = self.indices, self._values
+        if step > 0:
+            lo, hi = np.searchsorted(indices, [start, stop])
+            distances = indices[lo:hi] - start
+        else:
+            lo, hi = np.searchsorted(indices, [stop, start], side='right')
+            distances = start - indices[lo:hi]
+        keep = distances % abs(step) == 0
+        new_indices = distances[keep] // abs(step)
+        new_values = values[lo:hi][keep]
+        if step < 0:
+            new_indices, new_values = new_indices[::-1], new_values[::-1]
+        sv = SparseVector(len(range(start, stop, step)),
+                          default_value=self.default, dtype=self.dtype)
+        sv.indices = new_indices
+        sv.values = new_values.copy()
+        return sv
+
+    def __rebase(self):
+        """
+        Turn the stored indices of a slice view into actual positions.
+        This copies the indices, but the values stay shared.
+        """
+        if self._offset:
+            self._indices = self._indices - self._offset
+            self._offset = 0
+
+    def __flush(self, read=False):
+        """
+        Merge the staged writes, if any, into the sorted arrays.
+        """
+        buffer = self.write_buffer
+        if buffer is None or not buffer.pending:
+            return
+        if read:
+            buffer.read_merges += 1
+        self.__merge(*buffer.drain())
+
+    def __locate(self, indices):
+        """
+        Return the positions of the sorted `indices` in the internal arrays,
+        and whether each of them is actually stored there.
+        """
+        self.__rebase()
+        k = np.searchsorted(self._indices, indices)
+        found = k < self._indices.size
+        found[found] = self._indices[k[found]] == indices[found]
+        return k, found
+
+    def __merge(self, indices, values, located=None):
+        """
+        Write the `values` at the sorted and unique `indices`, in one pass.
+        """
+        if self._frozen:
+            raise ValueError('This SparseVector is frozen, copy() it to '
+                             'change it.')
+        k, found = located or self.__locate(indices)
+        overwrites = found.any()
+        dtype = np.result_type(self._values, values)
+        if dtype != self._values.dtype:
+            self.values = self._values.astype(dtype)
+            self._shared = False
+            if _instrumentation.enabled:
+                self.__count_reallocation()
+        elif self._shared and overwrites:
+            self.values = self._values.copy()
+            self._shared = False
+            if _instrumentation.enabled:
+                self.__count_reallocation()
+        if overwrites:
+            self._values[k[found]] = values[found]
+            self._version += 1
+        if not found.all():
+            new = ~found
+            self.__insert(k[new], indices[new], values[new])
+
+    def __insert(self, positions, indices, values):
+        """
+        Insert the absent `indices` with their `values` at the given sorted
+        `positions` of the internal arrays, in one pass.
+        """
+        self.__rebase()
+        total = self._indices.size + indices.size
+        at = positions + np.arange(indices.size)
+        old = np.ones(total, dtype=np.bool_)
+        old[at] = False
+        new_indices = np.empty(total, dtype=self._indices.dtype)
+        new_indices[old] = self._indices
+        new_indices[at] = indices
+        new_values = np.empty(total, dtype=np.result_type(self._values,
+                                                          values))
+        new_values[old] = self._values
+        new_values[at] = values
+        self.indices = new_indices
+        self.values = new_values
+        self._shared = False
+        if _instrumentation.enabled:
+            self.__count_reallocation()
+
+    def __delete(self, i):
+        """
+        Remove the value at the position `i` of the internal arrays.
+        """
+        self.__rebase()
+        self.indices = np.delete(self._indices, i)
+        self.values = np.delete(self._values, i)
+        self._shared = False
+        if _instrumentation.enabled:
+            self.__count_reallocation()
+
+    def __keep(self, mask):
+        """
+        Keep only the values of the internal arrays selected by `mask`.
+        """
+        self.__rebase()
+        self.indices = self._indices[mask]
+        self.values = self._values[mask]
+        self._shared = False
+        if _instrumentation.enabled:
+            self.__count_reallocation()
+
+    def __count_reallocation(self):
+        _instrumentation.count('reallocations')
+        _instrumentation.count('reallocated_bytes',
+                               self._indices.nbytes + self._values.nbytes)
 
     def __internal_index_of_index(self, index):
         if index < 0:
             index += self.size
-        k = np.where(self.indices == index)[0]
-        return k[0] if k.size > 0 else None
+        self.__rebase()
+        if _instrumentation.enabled:
+            _instrumentation.count('lookups')
+        k = np.searchsorted(self.indices, index)
+        if k < self._indices.size and self._indices[k] == index:
+            return k
+        return None
 
     def __internal_index_of_value(self, value):
+        if _instrumentation.enabled:
+            _instrumentation.count('scans')
         k = np.where(self.values == value)[0]
         return k[0] if k.size > 0 else None
 
@@ -188,6 +744,8 @@ class SparseVector(object):
         return not self.__lt__(other)
 
     def __mul__(self, multiplier):
+        if _is_expression(multiplier):
+            return NotImplemented
         result = []
         for _ in range(multiplier):
             result += self[:]
@@ -205,8 +763,12 @@ class SparseVector(object):
     def densify(self):
         """
         Return a dense representation of this vector, as a `numpy.ndarray` of
-        shape `(size,)`. This might blow up your RAM when `size` is big.
+        shape `(size,)`. This might blow up your RAM when `size` is big,
+        which the strict mode guards against. See `set_strict()`.
         """
+        _instrumentation.check_dense_allocation(
+            self.size * np.dtype(self.dtype).itemsize,
+            'Densifying a vector of size {}'.format(self.size))
         dense = np.full(self.size, fill_value=self.default, dtype=self.dtype)
         dense[self.indices] = self.values
         return dense
@@ -215,20 +777,100 @@ class SparseVector(object):
         """
         Append element, increasing size by exactly one.
         """
-        self.values = np.append(self.values, [element])
-        self.indices = np.append(self.indices, [self.size])
-        self.size += 1
+        self[self.size] = element
 
     push = append
 
-    def count(self, value):
+    def accumulate(self, indices, values, op='add'):
+        """
+        Combine `values` into this vector at `indices` with `op`, which may be
+        'add', 'max' or 'min', as would `self[i] = op(self[i], value)` for
+        each pair, but in a single merge pass. Duplicate indices are reduced
+        together first. `values` may also be a single value.
         """
-        Return the number of occurrences of `value` in this vector.
+        try:
+            ufunc = _ACCUMULATORS[op]
+        except KeyError:
+            raise ValueError('Unknown accumulation {}, use one of {}'.format(
+                op, ', '.join(sorted(_ACCUMULATORS))))
+        indices = np.asarray(indices, dtype=np.int).ravel()
+        if indices.size == 0:
+            return
+        values = np.broadcast_to(np.asarray(values), indices.shape)
+        indices = np.where(indices < 0, indices + self.size, indices)
+        if indices.min() < 0:
+            raise IndexError('SparseVector index out of range')
+        self.__flush()
+
+        unique, first, inverse = np.unique(indices, return_index=True,
+                                           return_inverse=True)
+        if ufunc is np.add and values.dtype.kind == 'f':
+            reduced = np.bincount(inverse, weights=values)
+        elif ufunc is np.add:
+            reduced = np.zeros(unique.size, dtype=values.dtype)
+            np.add.at(reduced, inverse, values)
+        else:
+            reduced = values[first].copy()
+            ufunc.at(reduced, inverse, values)
+
+        k, found = located = self.__locate(unique)
+        current = np.full(unique.size, self.default,
+                          dtype=np.result_type(self._values, reduced))
+        current[found] = self._values[k[found]]
+        self.__merge(unique, ufunc(current, reduced), located)
+        self.size = max(int(unique[-1]) + 1, self.size)
+
+    @classmethod
+    def from_counts(cls, indices, weights=None, size=None, dtype=None):
+        """
+        Return a vector holding how many times each index appears in
+        `indices`, like `numpy.bincount` but sparse.
+        When given, the `weights` of the indices are summed instead.
+        The `dtype` defaults to integers for counts and floats for weights.
+        """
+        if dtype is None:
+            dtype = np.int if weights is None else np.float
+        sv = cls(0 if size is None else size, dtype=dtype)
+        sv.accumulate(indices, 1 if weights is None else weights)
+        return sv
+
+    def enable_write_buffer(self, threshold=1024):
+        """
+        Stage the following writes in a `WriteBuffer`, and merge them into
+        the sorted arrays in one pass once `threshold` positions are staged,
+        or when a read needs the arrays. Return the buffer, whose `stats()`
+        tell how it performs.
+        """
+        self.__flush()
+        self.write_buffer = WriteBuffer(threshold)
+        return self.write_buffer
+
+    def disable_write_buffer(self):
+        """
+        Merge the staged writes and stop staging the following ones.
+        """
+        self.__flush()
+        self.write_buffer = None
+
+    def flush(self):
+        """
+        Merge the writes staged in the write buffer, if any.
+        """
+        self.__flush()
+
+    def count(self, value, start=None, stop=None):
+        """
+        Return the number of occurrences of `value` in this vector, or in its
+        positions `[start, stop)`.
         Counts the default values too if `value` is equal to the default value.
         """
-        return np.where(self.values == value)[0].size + (
-            self.size - len(self.values) if value == self.default else 0
-        )
+        start, stop, lo, hi = self.__window(start, stop)
+        if _instrumentation.enabled:
+            _instrumentation.count('scans')
+        found = np.count_nonzero(self._values[lo:hi] == value)
+        if value == self.default:
+            found += (stop - start) - (hi - lo)
+        return found
 
     def extend(self, iterable):
         """
@@ -236,27 +878,227 @@ class SparseVector(object):
         """
         self.__iadd__(iterable)
 
-    def index(self, value):
+    def index(self, value, start=None, stop=None):
         """
-        Return the first found index of `value`.
+        Return the lowest position of `value` in this vector, or in its
+        positions `[start, stop)`.
         Raises ValueError when the value is not present.
         """
+        start, stop, lo, hi = self.__window(start, stop)
+        if _instrumentation.enabled:
+            _instrumentation.count('scans')
+        stored = np.flatnonzero(self._values[lo:hi] == value)
+        first = self._indices[lo + stored[0]] if stored.size else stop
         if value == self.default:
-            i = 0
-            while i < self.size:
-                if self[i] == value:
-                    return i
-                i += 1
-        else:
-            i = self.__internal_index_of_value(value)
-            if i is not None:
-                return self.indices[i]
+            first = min(first, self.__first_gap(start, stop, lo, hi))
+        if first < stop:
+            return int(first)
         raise ValueError('{} not in SparseVector'.format(value))
 
+    def find_all(self, value, start=None, stop=None):
+        """
+        Return the sorted positions of `value` in this vector, or in its
+        positions `[start, stop)`, as a `numpy.ndarray`.
+        Finding the default value lists all the implicit positions, and is
+        guarded by the strict mode. See `set_strict()`.
+        """
+        start, stop, lo, hi = self.__window(start, stop)
+        if _instrumentation.enabled:
+            _instrumentation.count('scans')
+        found = self._indices[lo:hi][self._values[lo:hi] == value]
+        if value != self.default:
+            return found
+        gaps = self.__gaps(start, stop, lo, hi)
+        return np.sort(np.concatenate((found, gaps)))
+
+    def where(self, predicate):
+        """
+        Return a boolean vector telling where `predicate` holds, `predicate`
+        being a function of an array like a numpy ufunc, for instance
+        `numpy.isnan` or `lambda v: v > 3`. It is only evaluated on the
+        stored values and once on the default value.
+        """
+        default = bool(predicate(np.asarray(self.default)))
+        values = np.asarray(predicate(self.values), dtype=np.bool_)
+        keep = values != default
+        sv = SparseVector(self.size, default_value=default, dtype=np.bool_)
+        sv.indices = self.indices[keep]
+        sv.values = values[keep]
+        return sv
+
+    def sort(self, reverse=False):
+        """
+        Sort this vector in place, in ascending order unless `reverse`.
+        Only the stored values are sorted : the default values end up in a
+        single implicit run between the lower and the greater values.
+        NaNs count as greater than any value, as with `numpy.sort`.
+        """
+        lower, greater = self.__split_around_default()
+        lower = np.sort(self._values[lower], kind='mergesort')
+        greater = np.sort(self._values[greater], kind='mergesort')
+        if reverse:
+            lower, greater = greater[::-1], lower[::-1]
+        self.indices = np.concatenate((
+            np.arange(lower.size),
+            np.arange(self.size - greater.size, self.size)))
+        self.values = np.concatenate((lower, greater))
+        self._shared = False
+
+    def argsort(self, runs=False):
+        """
+        Return the positions that would sort this vector, the ties being in
+        the order of their positions, as a `numpy.ndarray` of `size`.
+        That array is dense, and guarded by the strict mode.
+
+        With `runs`, return a sparse description of that array instead : the
+        positions of the values lower than the default, sorted, an array of
+        the `[start, stop)` runs of default values, in order, and the
+        positions of the values greater than the default, sorted.
+        """
+        lower, greater = self.__split_around_default()
+        indices = self.indices
+        lower_positions = indices[lower][np.argsort(
+            self._values[lower], kind='mergesort')]
+        greater_positions = indices[greater][np.argsort(
+            self._values[greater], kind='mergesort')]
+        not_default = np.sort(np.concatenate((lower_positions,
+                                              greater_positions)))
+        bounds = np.concatenate(([-1], not_default, [self.size]))
+        starts, stops = bounds[:-1] + 1, bounds[1:]
+        nonempty = stops > starts
+        default_runs = np.column_stack((starts[nonempty], stops[nonempty]))
+        if runs:
+            return lower_positions, default_runs, greater_positions
+
+        _instrumentation.check_dense_allocation(
+            self.size * np.dtype(np.int).itemsize,
+            'Arg-sorting a vector of size {}'.format(self.size))
+        lengths = default_runs[:, 1] - default_runs[:, 0]
+        defaults = np.repeat(default_runs[:, 0] - np.cumsum(lengths) +
+                             lengths, lengths) + np.arange(lengths.sum())
+        return np.concatenate((lower_positions, defaults, greater_positions))
+
+    def unique(self, return_counts=False):
+        """
+        Return the sorted unique values of this vector, defaults included,
+        and how many times each one appears when `return_counts`.
+        """
+        values = self.values
+        implicit = self.size - values.size
+        if implicit > 0:
+            values = np.concatenate((values, [self.default]))
+        if not return_counts:
+            return np.unique(values)
+        unique, inverse = np.unique(values, return_inverse=True)
+        weights = np.ones(values.size, dtype=np.int)
+        if implicit > 0:
+            weights[-1] = implicit
+        return unique, np.bincount(inverse, weights=weights).astype(np.int)
+
+    def top_k(self, k):
+        """
+        Return the positions and the values of the `k` greatest values of
+        this vector, defaults included, greatest first. Ties go to the lowest
+        position. Selecting costs O(nnz), only the `k` values get sorted.
+        """
+        return self.__select(k, greatest=True)
+
+    def bottom_k(self, k):
+        """
+        Return the positions and the values of the `k` lowest values of this
+        vector, defaults included, lowest first. Ties go to the lowest
+        position. Selecting costs O(nnz), only the `k` values get sorted.
+        """
+        return self.__select(k, greatest=False)
+
+    def __select(self, k, greatest):
+        k = min(int(k), self.size)
+        values, indices = self.values, self.indices
+        if 0 < k < values.size:
+            # Keep every value tied with the k-th one, for the lowest
+            # positions to win the ties below. NaNs sort last.
+            if greatest:
+                threshold = np.partition(values, values.size - k)[-k]
+                chosen = (values >= threshold) | (values != values)
+            else:
+                threshold = np.partition(values, k - 1)[k - 1]
+                chosen = values <= threshold if threshold == threshold \
+                    else slice(None)
+            values, indices = values[chosen], indices[chosen]
+        if values.size < self.size:  # the defaults may make it
+            gaps = self.__first_gaps(k)
+            indices = np.concatenate((indices, gaps))
+            values = np.concatenate((values, np.full(
+                gaps.size, self.default, dtype=values.dtype)))
+        ranks = np.unique(values, return_inverse=True)[1]
+        order = np.lexsort((indices, -ranks if greatest else ranks))[:k]
+        return indices[order], values[order]
+
+    def __first_gaps(self, count):
+        """
+        Return the first `count` implicit positions, at most, in order.
+        """
+        indices = self.indices
+        bounds = np.concatenate(([-1], indices, [self.size]))
+        lengths = np.diff(bounds) - 1
+        needed = min(np.searchsorted(np.cumsum(lengths), count) + 1,
+                     lengths.size)
+        firsts, lengths = bounds[:needed] + 1, lengths[:needed].copy()
+        lengths[-1] -= max(0, lengths.sum() - count)
+        return np.repeat(firsts - np.cumsum(lengths) + lengths, lengths) + \
+            np.arange(lengths.sum())
+
+    def __split_around_default(self):
+        """
+        Return the masks of the stored values lower than and greater than
+        the default value. NaNs count as greater.
+        """
+        values = self.values
+        nans = values != values
+        return values < self.default, (values > self.default) | nans
+
+    def __window(self, start, stop):
+        """
+        Return the bounds of the positions `[start, stop)`, and the matching
+        bounds `[lo, hi)` in the internal arrays.
+        """
+        start, stop, _ = slice(start, stop).indices(self.size)
+        stop = max(start, stop)
+        lo, hi = np.searchsorted(self.indices, [start, stop])
+        return start, stop, int(lo), int(hi)
+
+    def __first_gap(self, start, stop, lo, hi):
+        """
+        Return the first implicit position in `[start, stop)`, or `stop`.
+        The stored indices `[lo, hi)` fill the window up to the first one
+        that is not at its rank, which a binary search finds.
+        """
+        a, b = 0, hi - lo
+        while a < b:
+            m = (a + b) // 2
+            if self._indices[lo + m] == start + m:
+                a = m + 1
+            else:
+                b = m
+        return start + a
+
+    def __gaps(self, start, stop, lo, hi):
+        """
+        Return the implicit positions in `[start, stop)`, in order.
+        """
+        count = (stop - start) - (hi - lo)
+        _instrumentation.check_dense_allocation(
+            count * np.dtype(np.int).itemsize,
+            'Finding {} default positions'.format(count))
+        bounds = np.concatenate(([start - 1], self._indices[lo:hi], [stop]))
+        lengths = np.diff(bounds) - 1
+        firsts = bounds[:-1] + 1
+        return np.repeat(firsts - np.cumsum(lengths) + lengths, lengths) + \
+            np.arange(count)
+
     def pop(self):
         """
         Remove and return the value at the end of this vector.
-        Warn: MAY NOT WORK AS EXPECTED as we don't sort our indices internally.
         Raises IndexError when the vector is empty.
         """
         if self.size < 1:
@@ -276,7 +1118,595 @@ class SparseVector(object):
             return
         i = self.__internal_index_of_value(value)
         if i is not None:
-            self.indices = np.delete(self.indices, i)
-            self.values = np.delete(self.values, i)
+            self.__delete(i)
         else:
             raise ValueError('{} not in SparseVector'.format(value))
+
+    def copy(self):
+        """
+        Return a copy of this vector, that shares no array with it.
+        """
+        sv = SparseVector(self.size, default_value=self.default,
+                          dtype=self.dtype)
+        sv.indices = self.indices.copy()
+        sv.values = self._values.copy()
+        return sv
+
+    @property
+    @_memoized
+    def nnz(self):
+        """
+        The number of stored values, some of which may equal the default.
+        """
+        return self._values.size
+
+    @_memoized
+    def sum(self):
+        """
+        Return the sum of all the values of this vector, defaults included.
+        """
+        total = self.values.sum()
+        if self.default != 0:
+            total += self.default * (self.size - self._values.size)
+        return total
+
+    @_memoized
+    def max(self):
+        """
+        Return the greatest value of this vector, defaults included.
+        Raises ValueError when the vector is empty.
+        """
+        return self.__extremum(np.max, max)
+
+    @_memoized
+    def min(self):
+        """
+        Return the lowest value of this vector, defaults included.
+        Raises ValueError when the vector is empty.
+        """
+        return self.__extremum(np.min, min)
+
+    def __extremum(self, reduce, pick):
+        if self.size < 1:
+            raise ValueError('extremum of an empty SparseVector')
+        values = self.values
+        if values.size == 0:
+            return self.default
+        if values.size == self.size:
+            return reduce(values)
+        return pick(reduce(values), self.default)
+
+    @_memoized
+    def norm(self):
+        """
+        Return the euclidean norm of this vector, defaults included.
+        """
+        values = self.values
+        squares = np.dot(values, values)
+        if self.default != 0:
+            squares += self.default ** 2 * (self.size - values.size)
+        return np.sqrt(squares)
+
+    @_memoized
+    def content_hash(self):
+        """
+        Return a digest of the size, default, dtype and stored values of
+        this vector, as an hexadecimal string. Vectors of the same content
+        have the same digest.
+        """
+        digest = hashlib.sha1()
+        digest.update(repr((self.size, self.default,
+                            self._values.dtype.str)).encode('utf-8'))
+        digest.update(np.asarray(self.indices, dtype='<i8').tobytes())
+        if self._values.dtype.hasobject:
+            digest.update(repr(self._values.tolist()).encode('utf-8'))
+        else:
+            digest.update(np.ascontiguousarray(self._values).tobytes())
+        return digest.hexdigest()
+
+    def dot(self, other):
+        """
+        Return the dot product of this vector with another `SparseVector` or
+        a dense array of the same size. The cost only depends on the number
+        of stored values when both are sparse.
+        """
+        if not isinstance(other, SparseVector):
+            dense = np.asarray(other)
+            assert dense.shape == (self.size,), \
+                "You can only dot vectors of the same size."
+            gathered = dense[self.indices]
+            result = np.dot(self._values, gathered)
+            if self.default != 0:
+                result += self.default * (dense.sum() - gathered.sum())
+            return result
+
+        assert len(other) == self.size, \
+            "You can only dot vectors of the same size."
+        if other.indices.size < self.indices.size:
+            return other.dot(self)
+        k = np.searchsorted(other._indices, self._indices)
+        found = k < other._indices.size
+        found[found] = other._indices[k[found]] == self._indices[found]
+        ours = self._values - self.default
+        theirs = other._values - other.default
+        result = np.dot(ours[found], theirs[k[found]])
+        if self.default != 0:
+            result += self.default * theirs.sum()
+        if other.default != 0:
+            result += other.default * ours.sum()
+        if self.default != 0 and other.default != 0:
+            result += self.default * other.default * self.size
+        return result
+
+    def diff(self, other):
+        """
+        Return the `SparseDelta` that turns the vector `other`, typically an
+        older version of this one, into this vector. It holds only the values
+        that were added, changed or removed, found by merging the stored
+        indices of both vectors.
+        """
+        indices, values = self.indices, self.values
+        old_indices, old_values = other.indices, other.values
+        k = np.searchsorted(old_indices, indices)
+        found = k < old_indices.size
+        found[found] = old_indices[k[found]] == indices[found]
+        changed = ~found
+        changed[found] = old_values[k[found]] != values[found]
+        k = np.searchsorted(indices, old_indices)
+        kept = k < indices.size
+        kept[kept] = indices[k[kept]] == old_indices[kept]
+        return SparseDelta(indices[changed], values[changed],
+                           old_indices[~kept], self.size,
+                           default_value=self.default, dtype=self.dtype)
+
+    def apply(self, delta):
+        """
+        Apply in place a `SparseDelta` made by `diff()`, in one batched
+        update of the internal arrays.
+        """
+        self.__flush()
+        if delta.removed.size:
+            k = np.searchsorted(delta.removed, self.indices)
+            doomed = k < delta.removed.size
+            doomed[doomed] = delta.removed[k[doomed]] == self._indices[doomed]
+            self.__keep(~doomed)
+        if delta.set_indices.size:
+            self.__merge(delta.set_indices, delta.set_values)
+        self.size = delta.size
+        self.default = delta.default
+
+    def matmul(self, W, sums=None, workers=None):
+        """
+        Return the product `self @ W` of this vector of size `n` with the
+        dense matrix `W` of shape `(n, d)`, as an array of `d` values.
+        Only the rows of `W` at the stored indices are read, in O(nnz * d).
+
+        sums : array_like, optional
+            The column sums of `W`, needed when the default value is not
+            zero, and computed when not given. Precompute them to reuse `W`.
+        workers : int, optional
+            Split the `d` columns of `W` among that many threads.
+        """
+        W = np.asarray(W)
+        assert W.ndim == 2 and W.shape[0] == self.size, \
+            "You can only multiply a matrix of {} rows.".format(self.size)
+        indices, coefficients = self.indices, self._values - self.default
+        result = _in_threads(
+            lambda a, b: np.dot(coefficients, W[indices, a:b]),
+            W.shape[1], workers)
+        if self.default != 0:
+            result = result + self.default * (W.sum(axis=0) if sums is None
+                                              else np.asarray(sums))
+        return result
+
+    __matmul__ = matmul
+
+    def __reduce_groups(self, firsts, counts, widths, op):
+        """
+        Reduce with `op` the groups of `widths` positions holding the stored
+        values `[firsts, firsts + counts)`, none of them empty. The default
+        values of each group are accounted for without being read.
+        """
+        values = self._values
+        if op == 'count':
+            return counts
+        missing = widths - counts
+        if op in ('sum', 'mean'):
+            sums = np.add.reduceat(values, firsts)
+            if self.default != 0:
+                sums = sums + self.default * missing
+            return sums if op == 'sum' else sums / widths.astype(np.float)
+        ufunc = np.maximum if op == 'max' else np.minimum
+        reduced = ufunc.reduceat(values, firsts)
+        return np.where(missing > 0, ufunc(reduced, self.default), reduced)
+
+    def __reduce_defaults(self, widths, op):
+        """
+        Reduce with `op` groups of `widths` default values.
+        """
+        widths = np.asarray(widths)
+        if op == 'count':
+            return np.zeros(widths.shape, dtype=np.int)
+        if op == 'sum':
+            return self.default * widths
+        return np.full(widths.shape, self.default)
+
+    def reduce_bins(self, bin_size, op='sum'):
+        """
+        Return the vector of the reductions with `op` of the consecutive
+        bins of `bin_size` positions of this vector, the last one possibly
+        shorter. `op` is `'sum'`, `'mean'`, `'max'`, `'min'`, or `'count'`,
+        which counts the stored values. Only the bins holding stored values
+        are reduced, the others get the default value of the result.
+        """
+        if op not in _REDUCTIONS:
+            raise ValueError('Unknown reduction {!r}, expected one of '
+                             '{}'.format(op, ', '.join(_REDUCTIONS)))
+        assert bin_size >= 1, "The bins must hold at least one position."
+        bins = -(-self.size // bin_size)
+        keys = self.indices // bin_size
+        first = np.ones(keys.size, dtype=np.bool_)
+        first[1:] = keys[1:] != keys[:-1]
+        firsts = np.flatnonzero(first)
+        touched = keys[firsts]
+        counts = np.diff(np.append(firsts, keys.size))
+        widths = np.minimum(bin_size, self.size - touched * bin_size)
+        reduced = self.__reduce_groups(firsts, counts, widths, op) \
+            if keys.size else self.__reduce_defaults(widths, op)
+        default = self.__reduce_defaults(bin_size, op)[()]
+        result = SparseVector(bins, default_value=default,
+                              dtype=np.result_type(reduced, default))
+        result.indices = touched
+        result.values = reduced.astype(result.dtype)
+        last = self.size % bin_size
+        if last and (not touched.size or touched[-1] != bins - 1):
+            shorter = self.__reduce_defaults(last, op)[()]
+            if shorter != default:
+                result[bins - 1] = shorter
+        return result
+
+    def reduceat(self, boundaries, op='sum'):
+        """
+        Return the reductions with `op` of the segments of this vector that
+        start at the increasing `boundaries` and end at the next boundary,
+        or at the end of the vector, like `numpy.ufunc.reduceat`, as an
+        array of `len(boundaries)` values. See `reduce_bins()` for `op`.
+        """
+        if op not in _REDUCTIONS:
+            raise ValueError('Unknown reduction {!r}, expected one of '
+                             '{}'.format(op, ', '.join(_REDUCTIONS)))
+        starts = np.asarray(boundaries, dtype=np.int)
+        stops = np.append(starts[1:], self.size)
+        assert (starts < stops).all() and (starts >= 0).all(), \
+            "The boundaries must increase within the vector."
+        indices = self.indices
+        firsts = np.searchsorted(indices, starts)
+        counts = np.searchsorted(indices, stops) - firsts
+        widths = stops - starts
+        filled = counts > 0
+        reduced = self.__reduce_defaults(widths, op)
+        if filled.any():
+            values = self.__reduce_groups(firsts[filled], counts[filled],
+                                          widths[filled], op)
+            reduced = reduced.astype(np.result_type(reduced, values))
+            reduced[filled] = values
+        return reduced
+
+    def __prefix_sums(self, positions):
+        """
+        Return the sums of the stored values minus the default at or before
+        each of the sorted `positions`.
+        """
+        indices = self.indices
+        excess = np.concatenate(([0], np.cumsum(self._values - self.default)))
+        return excess[np.searchsorted(indices, positions, side='right')]
+
+    def cumsum(self):
+        """
+        Return the cumulative sums of this vector, as a `RunLengthVector` of
+        as many runs as there are stored values : between them, the sums
+        grow by the default value at each position.
+        """
+        starts = np.union1d([0], self.indices)[:max(self.size, 0)]
+        values = self.__prefix_sums(starts) + self.default * (starts + 1)
+        return RunLengthVector(starts, values, self.size,
+                               slopes=self.default)
+
+    def rolling_sum(self, window):
+        """
+        Return the sums of the `window` positions of this vector ending at
+        each position, or of all the positions before the first full window,
+        as a `RunLengthVector` changing only where a stored value enters or
+        leaves the window.
+        """
+        assert window >= 1, "The window must hold at least one position."
+        indices = self.indices
+        starts = np.union1d(np.concatenate(([0, window - 1], indices)),
+                            indices + window)
+        starts = starts[starts < self.size]
+        values = self.__prefix_sums(starts) - \
+            self.__prefix_sums(starts - window) + \
+            self.default * np.minimum(starts + 1, window)
+        slopes = np.where(starts < window - 1, self.default, 0)
+        return RunLengthVector(starts, values, self.size, slopes=slopes)
+
+    def lazy(self):
+        """
+        Return this vector as a lazy `Expression` : arithmetic, numpy ufuncs
+        and masks on it build an expression tree, that is only evaluated, in
+        a single pass over the values of its vectors, by `compute()`, by a
+        reduction like `sum()` or `dot()`, or by reading a single position.
+        See `sparse_vector_lazy`.
+        """
+        from sparse_vector_lazy import Leaf
+        return Leaf(self)
+
+    def to_blocks(self, chunk_bits=16):
+        """
+        Return this vector as a `BlockSparseVector`, which stores the indices
+        chunk by chunk and is much lighter when values come in runs.
+        """
+        from sparse_vector_blocks import BlockSparseVector
+        return BlockSparseVector(self.indices, self.values,
+                                 default_value=self.default, size=self.size,
+                                 dtype=self.dtype, chunk_bits=chunk_bits)
+
+
+class RunLengthVector(object):
+    """
+    A vector of `size` made of runs : the run `r` starts at the position
+    `starts[r]` with the value `values[r]`, and grows by `slopes[r]` at each
+    following position up to the next run. With zero slopes, this is the
+    usual run-length encoding. `SparseVector.cumsum()` and `rolling_sum()`
+    return these.
+    """
+
+    def __init__(self, starts, values, size, slopes=0):
+        self.starts = np.asarray(starts, dtype=np.int)
+        self.values = np.asarray(values)
+        self.slopes = np.broadcast_to(slopes, self.starts.shape)
+        self.size = int(size)
+        assert not self.size or (self.starts.size and self.starts[0] == 0), \
+            "The first run must start at 0."
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def runs(self):
+        return self.starts.size
+
+    def take(self, positions):
+        """
+        Return the values at the given `positions`, as a `numpy.ndarray`.
+        """
+        positions = np.asarray(positions, dtype=np.int)
+        positions = np.where(positions < 0, positions + self.size, positions)
+        if ((positions < 0) | (positions >= self.size)).any():
+            raise IndexError('RunLengthVector index out of range')
+        r = np.searchsorted(self.starts, positions, side='right') - 1
+        return self.values[r] + self.slopes[r] * (positions - self.starts[r])
+
+    def __getitem__(self, index):
+        return self.take([index])[0]
+
+    def densify(self):
+        """
+        Return a dense representation of this vector, as a `numpy.ndarray` of
+        shape `(size,)`, guarded by the strict mode.
+        """
+        dtype = np.result_type(self.values, self.slopes)
+        _instrumentation.check_dense_allocation(
+            self.size * dtype.itemsize,
+            'Densifying runs of size {}'.format(self.size))
+        lengths = np.diff(np.append(self.starts, self.size))
+        offsets = np.arange(self.size) - np.repeat(self.starts, lengths)
+        return np.repeat(self.values, lengths) + \
+            np.repeat(self.slopes, lengths) * offsets
+
+    def __array__(self, dtype=None):
+        dense = self.densify()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __iter__(self):
+        return iter(self.densify())
+
+
+class SparseVectorBatch(object):
+    """
+    Many sparse vectors of the same `size`, stored back to back in three
+    arrays, like the rows of a CSR matrix : the vector `i` holds the values
+    `values[indptr[i]:indptr[i + 1]]` at the sorted positions
+    `indices[indptr[i]:indptr[i + 1]]`.
+
+    indptr : array_like of int
+        The `len(batch) + 1` boundaries of the vectors in `indices`.
+    indices : array_like of int
+        The positions of the values of all the vectors.
+    values : array_like
+        The values of all the vectors.
+    size : int
+        The size of each vector.
+    default_value : numerical, optional
+        The default value that fills most of each vector.
+    dtype : data-type, optional
+        Any object that can be interpreted as a numpy data type.
+    """
+
+    def __init__(self, indptr, indices, values, size, default_value=0,
+                 dtype=np.float):
+        self.indptr = np.asarray(indptr, dtype=np.int)
+        self.indices = np.asarray(indices, dtype=np.int)
+        self.values = np.asarray(values, dtype=dtype)
+        self.size = int(size)
+        self.default = default_value
+        self.dtype = dtype
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """
+        Return a batch holding copies of the given `SparseVector`s, which
+        must all share the same size and default value.
+        """
+        vectors = list(vectors)
+        assert vectors, "You must provide at least one vector."
+        first = vectors[0]
+        lengths = [v.indices.size for v in vectors]
+        return cls(np.concatenate(([0], np.cumsum(lengths))),
+                   np.concatenate([v.indices for v in vectors]),
+                   np.concatenate([v.values for v in vectors]),
+                   size=max(len(v) for v in vectors),
+                   default_value=first.default, dtype=first.dtype)
+
+    def __len__(self):
+        return self.indptr.size - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('SparseVectorBatch index out of range')
+        a, b = self.indptr[i], self.indptr[i + 1]
+        sv = SparseVector(self.size, default_value=self.default,
+                          dtype=self.dtype)
+        sv.indices = self.indices[a:b]
+        sv.values = self.values[a:b]
+        sv._shared = True  # copied on write
+        return sv
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nnz(self):
+        """
+        The number of values stored for all the vectors.
+        """
+        return self.indices.size
+
+    def matmul(self, W, sums=None, workers=None):
+        """
+        Return the products `sv @ W` of each vector of this batch with the
+        dense matrix `W` of shape `(size, d)`, as the rows of an array of
+        shape `(len(batch), d)`. See `SparseVector.matmul`.
+        """
+        W = np.asarray(W)
+        assert W.ndim == 2 and W.shape[0] == self.size, \
+            "You can only multiply a matrix of {} rows.".format(self.size)
+        coefficients = (self.values - self.default)[:, np.newaxis]
+
+        def compute(a, b):
+            return _segment_sums(W[self.indices, a:b] * coefficients,
+                                 self.indptr)
+        result = _in_threads(compute, W.shape[1], workers)
+        if self.default != 0:
+            result = result + self.default * (W.sum(axis=0) if sums is None
+                                              else np.asarray(sums))
+        return result
+
+    __matmul__ = matmul
+
+    def to_list(self):
+        """
+        Return the vectors of this batch as a list of `SparseVector`s.
+        """
+        return list(self)
+
+
+_DELTA_MAGIC = b'SVD1'
+_DELTA_HEADER = struct.Struct('<4sBBBQQQ')
+_INDEX_WIDTHS = ('<u1', '<u2', '<u4', '<u8')
+
+
+def _pack_indices(indices):
+    """
+    Return the sorted `indices` as their gaps in the narrowest unsigned
+    integers that fit, and the number of that width.
+    """
+    gaps = np.diff(np.concatenate(([0], indices))).astype(np.uint64)
+    top = gaps.max() if gaps.size else 0
+    for width, dtype in enumerate(_INDEX_WIDTHS):
+        if top <= np.iinfo(dtype).max:
+            return width, gaps.astype(dtype).tobytes()
+
+
+def _unpack_indices(width, count, data, offset):
+    gaps = np.frombuffer(data, dtype=_INDEX_WIDTHS[width], count=count,
+                         offset=offset)
+    return np.cumsum(gaps, dtype=np.int64), offset + gaps.nbytes
+
+
+class SparseDelta(object):
+    """
+    The changes that turn a `SparseVector` into another one, as made by
+    `SparseVector.diff()` and applied by `SparseVector.apply()`.
+
+    set_indices : array_like of int
+        The sorted positions of the values added or changed.
+    set_values : array_like
+        The values added or changed.
+    removed : array_like of int
+        The sorted positions that go back to the default value.
+    size : int
+        The size of the vector once changed.
+    default_value : numerical, optional
+        The default value of the vector once changed.
+    dtype : data-type, optional
+        Any object that can be interpreted as a numpy data type.
+    """
+
+    def __init__(self, set_indices, set_values, removed, size,
+                 default_value=0, dtype=np.float):
+        self.set_indices = np.asarray(set_indices, dtype=np.int)
+        self.set_values = np.asarray(set_values)
+        self.removed = np.asarray(removed, dtype=np.int)
+        self.size = int(size)
+        self.default = default_value
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.set_indices.size + self.removed.size
+
+    def to_bytes(self):
+        """
+        Return this delta as compact bytes : the indices are stored as the
+        gaps between them, in the narrowest unsigned integers that fit.
+        """
+        values = self.set_values
+        if values.dtype.hasobject:
+            raise TypeError('Cannot serialize values of dtype object')
+        descr = values.dtype.str.encode('ascii')
+        set_width, set_data = _pack_indices(self.set_indices)
+        removed_width, removed_data = _pack_indices(self.removed)
+        default = np.array([self.default], dtype=values.dtype)
+        return b''.join((
+            _DELTA_HEADER.pack(_DELTA_MAGIC, set_width, removed_width,
+                               len(descr), self.size, self.set_indices.size,
+                               self.removed.size),
+            descr, default.tobytes(), set_data, removed_data,
+            values.tobytes(),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Return the delta serialized in `data` by `to_bytes()`.
+        """
+        (magic, set_width, removed_width, descr_length, size, set_count,
+         removed_count) = _DELTA_HEADER.unpack_from(data)
+        if magic != _DELTA_MAGIC:
+            raise ValueError('Not a serialized SparseDelta')
+        offset = _DELTA_HEADER.size
+        dtype = np.dtype(data[offset:offset + descr_length].decode('ascii'))
+        offset += descr_length
+        default = np.frombuffer(data, dtype=dtype, count=1, offset=offset)
+        offset += dtype.itemsize
+        set_indices, offset = _unpack_indices(set_width, set_count, data,
+                                              offset)
+        removed, offset = _unpack_indices(removed_width, removed_count, data,
+                                          offset)
+        values = np.frombuffer(data, dtype=dtype, count=set_count,
+                               offset=offset)
+        return cls(set_indices, values.copy(), removed, size,
+                   default_value=default[0], dtype=dtype)
@@ -0,0 +1,474 @@
+"""
+
+A block-sparse storage for vectors whose non-default values come in runs
+(feature blocks, time windows...), similar in spirit to Roaring bitmaps:
+
+    http://roaringbitmap.org/
+
+The index space is cut into fixed chunks of `2 ** chunk_bits` positions.
+Each chunk that holds at least one value stores its in-chunk offsets in the
+cheapest of three containers :
+
+- an array container : the sorted offsets, as `uint16`,
+- a bitmap container : one bit per position of the chunk,
+- a run container    : the `(start, length)` of each contiguous run.
+
+The values themselves are stored per chunk, in index order, so that a
+contiguous run of values costs no index memory at all.
+
+"""
+
+import numpy as np
+
+from sparse_vector import SparseVector
+
+
+MAX_CHUNK_BITS = 16  # so that in-chunk offsets fit in an uint16
+
+
+def _popcount(words):
+    """
+    Return the number of set bits of each `uint64` word of `words`.
+    """
+    bits = np.unpackbits(words.view(np.uint8)).reshape(-1, 64)
+    return bits.sum(axis=1, dtype=np.int64)
+
+
+# `packbits` and `unpackbits` only take a `bitorder` from numpy 1.17 on : the
+# least significant bit first is had by reversing the bits of each byte.
+
+def _pack_little(bits):
+    """
+    Return the bytes of `bits`, least significant bit first.
+    """
+    return np.packbits(bits.reshape(-1, 8)[:, ::-1])
+
+
+def _unpack_little(data):
+    """
+    Return the bits of the bytes `data`, least significant bit first.
+    """
+    return np.unpackbits(data).reshape(-1, 8)[:, ::-1].ravel()
+
+
+class ArrayContainer(object):
+    """
+    Stores the sorted in-chunk offsets as an array of `uint16`.
+    Best when the chunk is sparsely filled.
+    """
+
+    def __init__(self, offsets):
+        self.offsets_array = np.asarray(offsets, dtype=np.uint16)
+
+    def __len__(self):
+        return self.offsets_array.size
+
+    @property
+    def nbytes(self):
+        return self.offsets_array.nbytes
+
+    def offsets(self):
+        return self.offsets_array.astype(np.int64)
+
+    def rank(self, offset):
+        """
+        Return the position of `offset` among the stored offsets, or -1.
+        """
+        k = np.searchsorted(self.offsets_array, offset)
+        if k < self.offsets_array.size and self.offsets_array[k] == offset:
+            return int(k)
+        return -1
+
+    def count_below(self, offset):
+        """
+        Return the number of stored offsets strictly lower than `offset`.
+        """
+        return int(np.searchsorted(self.offsets_array, offset))
+
+
+class BitmapContainer(object):
+    """
+    Stores one bit per position of the chunk, with a table of cumulated
+    population counts per 64-bit word to answer rank queries quickly.
+    Best when the chunk is densely but irregularly filled.
+    """
+
+    def __init__(self, offsets, chunk_size):
+        bits = np.zeros(max(chunk_size, 64), dtype=np.bool_)
+        bits[np.asarray(offsets, dtype=np.int64)] = True
+        self.words = _pack_little(bits).view('<u8')
+        counts = _popcount(self.words)
+        self.cumulated = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.cardinality = int(counts.sum())
+
+    def __len__(self):
+        return self.cardinality
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes + self.cumulated.nbytes
+
+    def offsets(self):
+        bits = _unpack_little(self.words.view(np.uint8))
+        return np.flatnonzero(bits)
+
+    def rank(self, offset):
+        """
+        Return the position of `offset` among the stored offsets, or -1.
+        """
+        offset = int(offset)  # numpy integers do not shift Python ones
+        word = int(self.words[offset >> 6])
+        bit = offset & 63
+        if not (word >> bit) & 1:
+            return -1
+        below = word & ((1 << bit) - 1)
+        return int(self.cumulated[offset >> 6]) + bin(below).count('1')
+
+    def count_below(self, offset):
+        """
+        Return the number of stored offsets strictly lower than `offset`.
+        """
+        offset = int(offset)
+        w = offset >> 6
+        if w >= self.words.size:
+            return self.cardinality
+        below = int(self.words[w]) & ((1 << (offset & 63)) - 1)
+        return int(self.cumulated[w]) + bin(below).count('1')
+
+
+class RunContainer(object):
+    """
+    Stores the contiguous runs of offsets as `(start, length - 1)` pairs.
+    Best when the chunk is made of a few long runs, and a completely filled
+    chunk costs a single run.
+    """
+
+    def __init__(self, starts, lengths):
+        self.starts = np.asarray(starts, dtype=np.uint16)
+        self.lengths_minus_one = np.asarray(lengths, dtype=np.int64) - 1
+        self.lengths_minus_one = self.lengths_minus_one.astype(np.uint16)
+        lengths = self.lengths_minus_one.astype(np.int64) + 1
+        self.cumulated = np.concatenate(([0], np.cumsum(lengths)))
+
+    def __len__(self):
+        return int(self.cumulated[-1])
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.lengths_minus_one.nbytes
+
+    def runs(self):
+        """
+        Return the `(starts, stops)` of the runs, as `int64` arrays.
+        """
+        starts = self.starts.astype(np.int64)
+        return starts, starts + self.lengths_minus_one + 1
+
+    def offsets(self):
+        starts, stops = self.runs()
+        lengths = stops - starts
+        shifts = np.repeat(starts - self.cumulated[:-1], lengths)
+        return np.arange(len(self), dtype=np.int64) + shifts
+
+    def rank(self, offset):
+        """
+        Return the position of `offset` among the stored offsets, or -1.
+        """
+        r = np.searchsorted(self.starts, offset, side='right') - 1
+        if r < 0 or offset > int(self.starts[r]) + int(
+                self.lengths_minus_one[r]):
+            return -1
+        return int(self.cumulated[r]) + offset - int(self.starts[r])
+
+    def count_below(self, offset):
+        """
+        Return the number of stored offsets strictly lower than `offset`.
+        """
+        r = np.searchsorted(self.starts, offset, side='right') - 1
+        if r < 0:
+            return 0
+        length = int(self.lengths_minus_one[r]) + 1
+        return int(self.cumulated[r]) + min(offset - int(self.starts[r]),
+                                            length)
+
+
+def make_container(offsets, chunk_size):
+    """
+    Return the smallest container holding the sorted, unique `offsets`.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(offsets) != 1) + 1
+    run_starts = offsets[np.concatenate(([0], breaks))]
+    run_lengths = np.diff(np.concatenate(([0], breaks, [offsets.size])))
+    array_bytes = 2 * offsets.size
+    bitmap_bytes = max(chunk_size, 64) // 4  # the bits and their ranks
+    run_bytes = 4 * run_starts.size
+    if run_bytes <= array_bytes and run_bytes <= bitmap_bytes:
+        return RunContainer(run_starts, run_lengths)
+    if array_bytes <= bitmap_bytes:
+        return ArrayContainer(offsets)
+    return BitmapContainer(offsets, chunk_size)
+
+
+class BlockSparseVector(object):
+    """
+    A read-mostly sparse vector whose indices are stored chunk by chunk,
+    each chunk in the cheapest of an array, a bitmap or a run container.
+
+    Lookups take one binary search in the chunk directory `keys`, then one
+    step inside the chunk's container. Range reads, densification of a
+    window and merges all work chunk at a time.
+
+    Most easily built from a `SparseVector` with `SparseVector.to_blocks()`.
+
+    indices : array_like of int
+        The positions of the values. Need not be sorted, but must be unique.
+    values : array_like
+        The values, in the same order as `indices`.
+    default_value : numerical, optional
+        The default value that fills most of this vector.
+    size : int, optional
+        When not provided, the vector will be as big as it needs.
+    dtype : data-type, optional
+        Any object that can be interpreted as a numpy data type.
+    chunk_bits : int, optional
+        Each chunk spans `2 ** chunk_bits` positions. At most 16.
+    """
+
+    def __init__(self, indices, values, default_value=0, size=None,
+                 dtype=np.float, chunk_bits=MAX_CHUNK_BITS):
+        assert 0 < chunk_bits <= MAX_CHUNK_BITS, \
+            "chunk_bits must be between 1 and {}.".format(MAX_CHUNK_BITS)
+        self.default = default_value
+        self.dtype = dtype
+        self.chunk_bits = chunk_bits
+        indices = np.asarray(indices, dtype=np.int64)
+        values = np.asarray(values, dtype=self.dtype)
+        assert indices.shape == values.shape, \
+            "You must provide as many indices as values."
+        if indices.size and np.any(np.diff(indices) <= 0):
+            order = np.argsort(indices, kind='mergesort')
+            indices, values = indices[order], values[order]
+        if size is None:
+            size = int(indices[-1]) + 1 if indices.size else 0
+        self.size = int(size)
+
+        chunk_keys = indices >> chunk_bits
+        bounds = np.flatnonzero(np.diff(chunk_keys)) + 1
+        starts = np.concatenate(([0], bounds)) if indices.size else bounds
+        stops = np.concatenate((bounds, [indices.size]))
+        self.keys = chunk_keys[starts]
+        self.containers = []
+        self.chunk_values = []
+        mask = self.chunk_size - 1
+        for start, stop in zip(starts, stops):
+            self.containers.append(make_container(
+                indices[start:stop] & mask, self.chunk_size))
+            self.chunk_values.append(values[start:stop])
+
+    @classmethod
+    def from_chunks(cls, keys, containers, chunk_values, default_value=0,
+                    size=0, dtype=np.float, chunk_bits=MAX_CHUNK_BITS):
+        """
+        Build a vector directly from already built chunks, sharing them.
+        """
+        blocks = cls([], [], default_value=default_value, size=size,
+                     dtype=dtype, chunk_bits=chunk_bits)
+        blocks.keys = np.asarray(keys, dtype=np.int64)
+        blocks.containers = list(containers)
+        blocks.chunk_values = list(chunk_values)
+        return blocks
+
+    @property
+    def chunk_size(self):
+        return 1 << self.chunk_bits
+
+    @property
+    def nnz(self):
+        """
+        The number of explicitly stored values.
+        """
+        return sum(len(c) for c in self.containers)
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes used by the indices, values and chunk directory.
+        """
+        return self.keys.nbytes + sum(c.nbytes for c in self.containers) + \
+            sum(v.nbytes for v in self.chunk_values)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        c = self.__chunk_of(index >> self.chunk_bits)
+        if c is None:
+            return self.default
+        k = self.containers[c].rank(index & (self.chunk_size - 1))
+        return self.default if k < 0 else self.chunk_values[c][k]
+
+    def __chunk_of(self, key):
+        c = np.searchsorted(self.keys, key)
+        if c < self.keys.size and self.keys[c] == key:
+            return int(c)
+        return None
+
+    def __chunk_range(self, start, stop):
+        """
+        Return the `(first, last)` chunk numbers overlapping `[start, stop)`.
+        """
+        lo = np.searchsorted(self.keys, start >> self.chunk_bits)
+        hi = np.searchsorted(self.keys, (stop - 1) >> self.chunk_bits,
+                             side='right')
+        return int(lo), int(hi)
+
+    def __window(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self.size)
+        return start, max(start, stop)
+
+    def take(self, indices):
+        """
+        Return the values at the given positions, as a `numpy.ndarray`.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + self.size, indices)
+        out = np.full(indices.shape, self.default, dtype=self.dtype)
+        flat, out_flat = indices.ravel(), out.reshape(-1)
+        keys = flat >> self.chunk_bits
+        chunks = np.minimum(np.searchsorted(self.keys, keys),
+                            max(self.keys.size - 1, 0))
+        stored = np.flatnonzero(self.keys[chunks] == keys) \
+            if self.keys.size else np.array([], dtype=np.int64)
+        # group the positions by chunk once, to handle each chunk in one pass
+        stored = stored[np.argsort(chunks[stored], kind='mergesort')]
+        touched, starts = np.unique(chunks[stored], return_index=True)
+        stops = np.append(starts[1:], stored.size)
+        for c, a, b in zip(touched, starts, stops):
+            where = stored[a:b]
+            offsets = self.containers[c].offsets()
+            wanted = flat[where] & (self.chunk_size - 1)
+            k = np.searchsorted(offsets, wanted)
+            k_safe = np.minimum(k, offsets.size - 1)
+            found = offsets[k_safe] == wanted
+            out_flat[where[found]] = self.chunk_values[c][k_safe[found]]
+        return out
+
+    def items(self, start=None, stop=None):
+        """
+        Return the `(indices, values)` stored in `[start, stop)`, sorted.
+        """
+        start, stop = self.__window(start, stop)
+        indices, values = [np.array([], dtype=np.int64)], \
+            [np.array([], dtype=self.dtype)]
+        if stop <= start:
+            return indices[0], values[0]
+        lo, hi = self.__chunk_range(start, stop)
+        for c in range(lo, hi):
+            container = self.containers[c]
+            base = int(self.keys[c]) << self.chunk_bits
+            a = container.count_below(max(start - base, 0))
+            b = container.count_below(min(stop - base, self.chunk_size))
+            indices.append(container.offsets()[a:b] + base)
+            values.append(self.chunk_values[c][a:b])
+        return np.concatenate(indices), np.concatenate(values)
+
+    def densify(self, start=None, stop=None):
+        """
+        Return a dense `numpy.ndarray` of the window `[start, stop)`,
+        by default the whole vector. Run containers are filled by slices.
+        """
+        start, stop = self.__window(start, stop)
+        dense = np.full(stop - start, self.default, dtype=self.dtype)
+        if stop <= start:
+            return dense
+        lo, hi = self.__chunk_range(start, stop)
+        for c in range(lo, hi):
+            container = self.containers[c]
+            values = self.chunk_values[c]
+            base = int(self.keys[c]) << self.chunk_bits
+            if isinstance(container, RunContainer):
+                run_starts, run_stops = container.runs()
+                for r, (a, b) in enumerate(zip(run_starts + base,
+                                               run_stops + base)):
+                    lo_, hi_ = max(a, start), min(b, stop)
+                    if lo_ < hi_:
+                        k = int(container.cumulated[r]) + lo_ - a
+                        dense[lo_ - start:hi_ - start] = \
+                            values[k:k + hi_ - lo_]
+            else:
+                indices = container.offsets() + base
+                keep = (indices >= start) & (indices < stop)
+                dense[indices[keep] - start] = values[keep]
+        return dense
+
+    def merge(self, other, op=None):
+        """
+        Return a new vector holding the union of the values of both vectors.
+        Where both hold a value, use the one of `other`, or `op(ours, theirs)`
+        when a binary `op` like `numpy.add` is given.
+        Chunks present in only one of the vectors are shared, not copied.
+        """
+        assert self.chunk_bits == other.chunk_bits, \
+            "You can only merge vectors with the same chunk_bits."
+        keys, containers, chunk_values = [], [], []
+        i = j = 0
+        while i < self.keys.size or j < other.keys.size:
+            a = self.keys[i] if i < self.keys.size else None
+            b = other.keys[j] if j < other.keys.size else None
+            if b is None or (a is not None and a < b):
+                keys.append(a)
+                containers.append(self.containers[i])
+                chunk_values.append(self.chunk_values[i])
+                i += 1
+            elif a is None or b < a:
+                keys.append(b)
+                containers.append(other.containers[j])
+                chunk_values.append(other.chunk_values[j])
+                j += 1
+            else:
+                offsets, values = self.__merge_chunk(
+                    self.containers[i].offsets(), self.chunk_values[i],
+                    other.containers[j].offsets(), other.chunk_values[j], op)
+                keys.append(a)
+                containers.append(make_container(offsets, self.chunk_size))
+                chunk_values.append(values)
+                i += 1
+                j += 1
+        dtype = np.result_type(self.dtype, other.dtype)
+        return BlockSparseVector.from_chunks(
+            keys, containers, [v.astype(dtype, copy=False)
+                               for v in chunk_values],
+            default_value=self.default, size=max(self.size, other.size),
+            dtype=dtype, chunk_bits=self.chunk_bits)
+
+    @staticmethod
+    def __merge_chunk(ours_offsets, ours_values, their_offsets, their_values,
+                      op):
+        offsets = np.union1d(ours_offsets, their_offsets)
+        values = np.empty(offsets.size, dtype=np.result_type(
+            ours_values, their_values))
+        ours = np.searchsorted(offsets, ours_offsets)
+        theirs = np.searchsorted(offsets, their_offsets)
+        values[ours] = ours_values
+        if op is None:
+            values[theirs] = their_values
+        else:
+            both = np.in1d(their_offsets, ours_offsets, assume_unique=True)
+            values[theirs[~both]] = their_values[~both]
+            values[theirs[both]] = op(values[theirs[both]],
+                                      their_values[both])
+        return offsets, values
+
+    def to_sparse_vector(self):
+        """
+        Return this vector as a flat `SparseVector`.
+        """
+        indices, values = self.items()
+        sv = SparseVector(self.size, default_value=self.default,
+                          dtype=self.dtype)
+        sv.indices = indices
+        sv.values = values
+        return sv
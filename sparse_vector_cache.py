@@ -0,0 +1,203 @@
+"""
+
+A cache of `SparseVector`s by id, under a budget of bytes rather than of
+entries : vectors of a few values and vectors of millions of values weigh
+what they actually take, as told by `SparseVector.nbytes`.
+
+The least recently used vectors are evicted first, or, with the `'size'`
+policy, the ones that are both old and large (GreedyDual-Size), which keeps
+more vectors in the same budget. Threads asking for the same missing id
+at the same time wait for a single load.
+
+"""
+
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+
+class _Load(object):
+    """
+    A load in progress, that other threads asking for the same id wait for.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.vector = None
+        self.error = None
+
+
+class SparseVectorCache(object):
+    """
+    Keeps the `SparseVector`s of the last ids asked for, within `max_bytes`.
+
+        cache = SparseVectorCache(store.__getitem__, max_bytes=2 ** 30)
+        sv = cache[id]  # loaded once, then served from memory
+
+    loader : callable, optional
+        Returns the vector of an id that is not cached, or raises `KeyError`.
+        Without it, vectors are only cached with `put()`.
+    max_bytes : int, optional
+        The budget of the cached vectors. A vector larger than the whole
+        budget is returned but not cached.
+    policy : str, optional
+        `'lru'` evicts the least recently used vectors, `'size'` favors
+        evicting the large ones.
+
+    The size of a vector is measured when it is cached : vectors should not
+    be modified while cached, or be `put()` again after.
+    """
+
+    POLICIES = ('lru', 'size')
+
+    def __init__(self, loader=None, max_bytes=2 ** 28, policy='lru'):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown cache policy {!r}, expected one of '
+                             '{}'.format(policy, ', '.join(self.POLICIES)))
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses that waited for another thread's load
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (vector, nbytes), oldest first
+        self._loads = {}  # id -> _Load
+        # GreedyDual-Size : the priority of an entry is the clock when it
+        # was last used plus its inverse size, and the clock moves up to the
+        # priority of each evicted entry, so that old entries age out.
+        self._clock = 0.
+        self._priorities = {}
+        self._heap = []
+        self._ties = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def get(self, key, loader=None):
+        """
+        Return the vector of `key`, loading it with `loader`, or the loader
+        of this cache, when it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.__touch(key, entry[1])
+                return entry[0]
+            self.misses += 1
+            load = self._loads.get(key)
+            owner = load is None
+            if owner:
+                load = self._loads[key] = _Load()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            return load.vector
+
+        try:
+            loader = loader or self.loader
+            if loader is None:
+                raise KeyError(key)
+            load.vector = loader(key)
+        except Exception as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._loads[key]
+                if load.error is None:
+                    self.__put(key, load.vector)
+            load.done.set()
+        return load.vector
+
+    def put(self, key, sv):
+        """
+        Cache the vector `sv` of `key`, replacing any previous one.
+        """
+        with self._lock:
+            self.__put(key, sv)
+
+    def discard(self, key):
+        """
+        Remove the vector of `key` from the cache, if it is cached.
+        """
+        with self._lock:
+            self.__remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self.__remove(key)
+
+    def stats(self):
+        """
+        Return the counters of this cache as a `dict`.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+            }
+
+    def __put(self, key, sv):
+        self.__remove(key)
+        nbytes = sv.nbytes
+        if nbytes > self.max_bytes:
+            return
+        while self.nbytes + nbytes > self.max_bytes:
+            self.__evict()
+        self._entries[key] = (sv, nbytes)
+        self.nbytes += nbytes
+        self.__touch(key, nbytes)
+
+    def __touch(self, key, nbytes):
+        if self.policy == 'lru':
+            self._entries[key] = self._entries.pop(key)  # most recent last
+        else:
+            priority = self._clock + 1. / max(nbytes, 1)
+            self._priorities[key] = priority
+            heapq.heappush(self._heap, (priority, next(self._ties), key))
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [(p, next(self._ties), k)
+                              for k, p in self._priorities.items()]
+                heapq.heapify(self._heap)
+
+    def __remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+            self._priorities.pop(key, None)
+        return entry
+
+    def __evict(self):
+        if self.policy == 'lru':
+            key = next(iter(self._entries))
+        else:
+            while True:  # skip the stale priorities of touched entries
+                priority, _, key = heapq.heappop(self._heap)
+                if self._priorities.get(key) == priority:
+                    break
+            self._clock = priority
+        self.evictions += 1
+        self.evicted_bytes += self.__remove(key)[1]
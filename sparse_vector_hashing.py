@@ -0,0 +1,176 @@
+"""
+
+Turn streams of tokenized documents into `SparseVector`s with the hashing
+trick : each token is hashed into one of `size` positions, without any
+vocabulary to keep around. cf. Feature hashing:
+
+    http://en.wikipedia.org/wiki/Feature_hashing
+
+Tokens are hashed with MurmurHash3 (x86, 32 bits), vectorized with numpy
+over all the distinct tokens of a batch at once.
+
+"""
+
+import numpy as np
+from six import string_types
+
+from sparse_vector import SparseVectorBatch
+
+
+_C1 = np.uint32(0xcc9e2d51)
+_C2 = np.uint32(0x1b873593)
+
+
+def _rotl(x, r):
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+
+def _fmix(h):
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85ebca6b)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xc2b2ae35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def murmurhash3_32(keys, seed=0):
+    """
+    Return the MurmurHash3 (x86, 32 bits) of each of the `keys`, as an array
+    of `uint32`. The keys are either `bytes`, hashed as is, or text, hashed
+    through its UTF-32-LE encoding, which is how numpy stores it.
+    """
+    # numpy strips trailing null characters, so measure the keys first
+    lengths = None if isinstance(keys, np.ndarray) else \
+        np.array([len(k) for k in keys], dtype=np.int64)
+    keys = np.asarray(keys)
+    if keys.dtype.kind not in 'SU':
+        raise TypeError('Can only hash bytes or text, not {}'.format(
+            keys.dtype))
+    n = keys.size
+    keys = keys.ravel()
+    if lengths is None:
+        lengths = np.char.str_len(keys).astype(np.int64)
+    if keys.dtype.kind == 'U':
+        lengths *= 4
+
+    # Zero-pad every key to the same number of 4-bytes blocks
+    width = max(keys.dtype.itemsize, 1)
+    padded = -(-width // 4) * 4
+    data = np.zeros((n, padded), dtype=np.uint8)
+    if n:
+        data[:, :width] = keys.view(np.uint8).reshape(n, width)
+    blocks = data.view('<u4')
+    full_blocks = lengths // 4
+
+    with np.errstate(over='ignore'):
+        h = np.full(n, seed, dtype=np.uint32)
+        for j in range(blocks.shape[1]):
+            active = j < full_blocks
+            if not active.any():
+                break
+            k = _rotl(blocks[:, j] * _C1, 15) * _C2
+            mixed = _rotl(h ^ k, 13) * np.uint32(5) + np.uint32(0xe6546b64)
+            h = np.where(active, mixed, h)
+        # The zero padding makes the block after the last full one the tail
+        has_tail = (lengths & 3) > 0
+        if has_tail.any():
+            rows = np.flatnonzero(has_tail)
+            k = blocks[rows, full_blocks[rows]]
+            h[rows] ^= _rotl(k * _C1, 15) * _C2
+        h ^= lengths.astype(np.uint32)
+        return _fmix(h)
+
+
+class HashingVectorizer(object):
+    """
+    Turns documents into `SparseVector`s of a fixed `size` by hashing their
+    tokens, all the documents of a batch at once.
+
+    A document is either an iterable of tokens, each counting for one, a
+    `dict` of tokens to their weights, or a string that `analyzer` splits
+    into tokens. Tokens are text or bytes, and categorical features are best
+    fed as `'feature=value'` tokens.
+
+    size : int, optional
+        The size of the vectors, at most `2 ** 31`.
+    alternate_sign : bool, optional
+        When true, the highest bit of the hash gives the sign of each token,
+        so that collisions tend to cancel out instead of piling up.
+    seed : int, optional
+        The seed of the hash function.
+    analyzer : callable, optional
+        Splits string documents into tokens. Splits on whitespace by default.
+    dtype : data-type, optional
+        Any object that can be interpreted as a numpy data type.
+    """
+
+    def __init__(self, size=2 ** 20, alternate_sign=True, seed=0,
+                 analyzer=None, dtype=np.float):
+        assert 0 < size <= 2 ** 31, "The size must be in (0, 2**31]."
+        self.size = int(size)
+        self.alternate_sign = alternate_sign
+        self.seed = seed
+        self.analyzer = analyzer
+        self.dtype = dtype
+
+    def hash(self, tokens):
+        """
+        Return the positions and signs of the given tokens.
+        """
+        hashes = murmurhash3_32(tokens, seed=self.seed)
+        if self.alternate_sign:
+            positions = (hashes & np.uint32(0x7fffffff)) % self.size
+            signs = np.where(hashes >> np.uint32(31), -1, 1)
+        else:
+            positions = hashes % self.size
+            signs = np.ones(hashes.size, dtype=np.int)
+        return positions.astype(np.int64), signs
+
+    def __tokens(self, document):
+        if isinstance(document, dict):
+            return list(document.keys()), list(document.values())
+        if isinstance(document, string_types):
+            document = self.analyzer(document) if self.analyzer \
+                else document.split()
+        return list(document), None
+
+    def transform_batch(self, documents):
+        """
+        Return the vectors of the given documents as a `SparseVectorBatch`.
+        Each distinct token of the batch is hashed only once, and colliding
+        tokens of a document add up.
+        """
+        tokens, weights, lengths = [], [], []
+        for document in documents:
+            doc_tokens, doc_weights = self.__tokens(document)
+            tokens.extend(doc_tokens)
+            weights.append(np.ones(len(doc_tokens)) if doc_weights is None
+                           else np.asarray(doc_weights, dtype=np.float))
+            lengths.append(len(doc_tokens))
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int)
+        if not tokens:
+            return SparseVectorBatch(indptr, [], [], self.size,
+                                     dtype=self.dtype)
+
+        distinct, inverse = np.unique(np.asarray(tokens),
+                                      return_inverse=True)
+        positions, signs = self.hash(distinct)
+        docs = np.repeat(np.arange(len(lengths)), lengths)
+        keys, merged = np.unique(docs * self.size + positions[inverse],
+                                 return_inverse=True)
+        values = np.bincount(merged, weights=np.concatenate(weights) *
+                             signs[inverse])
+        keep = values != 0  # tokens that cancelled each other out
+        keys, values = keys[keep], values[keep]
+        indptr[1:] = np.searchsorted(keys // self.size,
+                                     np.arange(len(lengths)), side='right')
+        return SparseVectorBatch(indptr, keys % self.size, values, self.size,
+                                 dtype=self.dtype)
+
+    def transform(self, documents):
+        """
+        Return the vectors of the given documents as a list of
+        `SparseVector`s.
+        """
+        return self.transform_batch(documents).to_list()
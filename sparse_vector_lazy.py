@@ -0,0 +1,318 @@
+"""
+
+Lazy expressions over `SparseVector`s. Chaining operations like
+
+    (a.lazy() * w + b).clip(0).dot(q)
+
+builds an expression tree instead of a temporary vector at each step.
+The tree is evaluated in a single pass : the supports (stored indices) of
+all its vectors are merged once, each vector is gathered once over that
+merged support, and every elementwise step then runs on these compact
+arrays, reusing the buffers of the intermediate results. The default value
+of the result is found by running the same steps on the default values.
+
+Evaluation happens on `compute()`, on a reduction (`sum()`, `dot()`...), or
+when reading a single position, which only evaluates that position.
+
+"""
+
+import numpy as np
+
+from sparse_vector import SparseVector
+
+
+class Expression(object):
+    """
+    A node of a lazy expression tree over `SparseVector`s of the same size.
+    Build one with `SparseVector.lazy()`, or `lazy()`.
+    """
+
+    def leaves(self):
+        """
+        Return the distinct `SparseVector`s of this expression.
+        """
+        raise NotImplementedError()
+
+    def evaluate(self, gathered, defaults):
+        """
+        Return the values of this expression given the `gathered` values of
+        each leaf vector, keyed by `id`, and whether the returned array is a
+        temporary that may be overwritten. With `defaults`, the leaves are
+        scalars instead of arrays.
+        """
+        raise NotImplementedError()
+
+    @property
+    def size(self):
+        sizes = set(len(leaf) for leaf in self.leaves())
+        assert len(sizes) == 1, \
+            "You can only combine vectors of the same size."
+        return sizes.pop()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        """
+        Evaluate this expression at a single position.
+        """
+        size = self.size
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('Expression index out of range')
+        gathered = dict((id(leaf), np.asarray(leaf[index], dtype=leaf.dtype))
+                        for leaf in self.leaves())
+        return self.evaluate(gathered, True)[0][()]
+
+    def compute(self):
+        """
+        Evaluate this expression into a new `SparseVector`.
+        """
+        leaves = self.leaves()
+        size = self.size
+        supports = [leaf.indices for leaf in leaves]
+        if all(s is supports[0] or np.array_equal(s, supports[0])
+               for s in supports[1:]):
+            support = supports[0]
+        else:
+            support = np.unique(np.concatenate(supports))
+
+        gathered, defaults = {}, {}
+        for leaf in leaves:
+            default = np.asarray(leaf.default, dtype=leaf.dtype)
+            defaults[id(leaf)] = default
+            if leaf.indices is support or leaf.indices.size == support.size:
+                gathered[id(leaf)] = leaf.values
+                continue
+            k = np.searchsorted(leaf.indices, support)
+            found = k < leaf.indices.size
+            found[found] = leaf.indices[k[found]] == support[found]
+            values = np.full(support.size, default,
+                             dtype=np.result_type(leaf.values, default))
+            values[found] = leaf.values[k[found]]
+            gathered[id(leaf)] = values
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            default = self.evaluate(defaults, True)[0][()]
+            values = np.asarray(self.evaluate(gathered, False)[0])
+        if values.shape != support.shape:  # an expression of constants
+            values = np.broadcast_to(values, support.shape)
+        keep = values != default
+        if default != default:  # NaN
+            keep &= values == values
+        result = SparseVector(size, default_value=default, dtype=values.dtype)
+        result.indices = support[keep]
+        result.values = values[keep]
+        return result
+
+    # Reductions
+
+    def sum(self):
+        return self.compute().sum()
+
+    def mean(self):
+        return self.sum() / float(self.size)
+
+    def max(self):
+        return self.compute().max()
+
+    def min(self):
+        return self.compute().min()
+
+    def norm(self):
+        return self.compute().norm()
+
+    def dot(self, other):
+        if isinstance(other, Expression):
+            other = other.compute()
+        return self.compute().dot(other)
+
+    # Elementwise operations
+
+    def apply(self, func, *args):
+        """
+        Return the lazy result of `func(self, *args)`, where `func` is any
+        elementwise function working on arrays and scalars alike, like a
+        numpy ufunc. The `args` may be other expressions or vectors.
+        """
+        return Apply(func, (self,) + args)
+
+    def clip(self, lower=None, upper=None):
+        return Apply(np.clip, (self, lower, upper))
+
+    def where(self, condition, other=0):
+        """
+        Return the lazy result of taking this expression where `condition`
+        holds, and `other` elsewhere.
+        """
+        return Apply(np.where, (condition, self, other))
+
+    def mask(self, condition, value=0):
+        """
+        Return the lazy result of replacing by `value` the positions of this
+        expression where `condition` holds.
+        """
+        return Apply(np.where, (condition, value, self))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs or ufunc.nout != 1:
+            return NotImplemented
+        return Apply(ufunc, inputs)
+
+    def __add__(self, other):
+        return Apply(np.add, (self, other))
+
+    def __radd__(self, other):
+        return Apply(np.add, (other, self))
+
+    def __sub__(self, other):
+        return Apply(np.subtract, (self, other))
+
+    def __rsub__(self, other):
+        return Apply(np.subtract, (other, self))
+
+    def __mul__(self, other):
+        return Apply(np.multiply, (self, other))
+
+    def __rmul__(self, other):
+        return Apply(np.multiply, (other, self))
+
+    def __truediv__(self, other):
+        return Apply(np.true_divide, (self, other))
+
+    def __rtruediv__(self, other):
+        return Apply(np.true_divide, (other, self))
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, other):
+        return Apply(np.power, (self, other))
+
+    def __rpow__(self, other):
+        return Apply(np.power, (other, self))
+
+    def __neg__(self):
+        return Apply(np.negative, (self,))
+
+    def __abs__(self):
+        return Apply(np.absolute, (self,))
+
+    def __lt__(self, other):
+        return Apply(np.less, (self, other))
+
+    def __le__(self, other):
+        return Apply(np.less_equal, (self, other))
+
+    def __gt__(self, other):
+        return Apply(np.greater, (self, other))
+
+    def __ge__(self, other):
+        return Apply(np.greater_equal, (self, other))
+
+    def __eq__(self, other):
+        return Apply(np.equal, (self, other))
+
+    def __ne__(self, other):
+        return Apply(np.not_equal, (self, other))
+
+    def __and__(self, other):
+        return Apply(np.logical_and, (self, other))
+
+    def __or__(self, other):
+        return Apply(np.logical_or, (self, other))
+
+    def __invert__(self):
+        return Apply(np.logical_not, (self,))
+
+    __hash__ = object.__hash__
+
+
+class Leaf(Expression):
+    """
+    A `SparseVector` in an expression tree.
+    """
+
+    def __init__(self, vector):
+        self.vector = vector
+
+    def leaves(self):
+        return [self.vector]
+
+    def evaluate(self, gathered, defaults):
+        return gathered[id(self.vector)], False
+
+    def __repr__(self):
+        return 'SparseVector#{:x}'.format(id(self.vector))
+
+
+def _as_operand(arg):
+    if isinstance(arg, SparseVector):
+        return Leaf(arg)
+    if isinstance(arg, Expression):
+        return arg
+    if np.ndim(arg) != 0:
+        raise TypeError('Can only combine lazy expressions with vectors or '
+                        'scalars, not {}'.format(type(arg).__name__))
+    return arg
+
+
+class Apply(Expression):
+    """
+    An elementwise function applied to expressions and scalars.
+    """
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = tuple(_as_operand(a) for a in args)
+
+    def leaves(self):
+        seen = {}
+        for arg in self.args:
+            if isinstance(arg, Expression):
+                for leaf in arg.leaves():
+                    seen.setdefault(id(leaf), leaf)
+        return list(seen.values())
+
+    def evaluate(self, gathered, defaults):
+        args, temporaries = [], []
+        for arg in self.args:
+            if isinstance(arg, Expression):
+                value, temporary = arg.evaluate(gathered, defaults)
+                if temporary:
+                    temporaries.append(value)
+                args.append(value)
+            else:
+                args.append(arg)
+        if temporaries and isinstance(self.func, np.ufunc) and not defaults:
+            # Write into the buffer of an intermediate result when possible
+            dtype = self.func(*[a[:0] if isinstance(a, np.ndarray) else a
+                                for a in args]).dtype
+            for out in temporaries:
+                if out.dtype == dtype and out.ndim == 1:
+                    return self.func(*args, out=out), True
+        result = np.asarray(self.func(*args))
+        # any function may return one of its arguments, or a view of it
+        shared = any(isinstance(a, np.ndarray) and np.shares_memory(result, a)
+                     for a in args)
+        return result, not shared
+
+    def __repr__(self):
+        name = getattr(self.func, '__name__', repr(self.func))
+        return '{}({})'.format(name, ', '.join(repr(a) for a in self.args))
+
+
+def lazy(vector):
+    """
+    Return the given `SparseVector` as a lazy `Expression`.
+    """
+    return Leaf(vector)
+
+
+def where(condition, x, y):
+    """
+    Return the lazy result of taking `x` where `condition` holds, and `y`
+    elsewhere, like `numpy.where`.
+    """
+    return Apply(np.where, (condition, x, y))
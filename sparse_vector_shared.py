@@ -0,0 +1,171 @@
+"""
+
+A `SparseVector` shared between threads, read without locks while a single
+writer at a time updates it, as in read-copy-update :
+
+- the state of the vector is an immutable `Snapshot` of its arrays,
+- readers take the current snapshot, which no one will ever modify, and
+  read it as long as they please, consistently,
+- a writer copies the current snapshot on write, changes its copy, and
+  publishes it as the new snapshot by swapping a single reference.
+
+Each publication copies the arrays, so writers should batch their changes
+with `batch()`, which publishes them all at once.
+
+"""
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from sparse_vector import SparseVector
+
+
+def _frozen(array):
+    array = np.asarray(array)
+    if array.flags.writeable:
+        array = array.view()
+        array.setflags(write=False)
+    return array
+
+
+class Snapshot(object):
+    """
+    An immutable state of a `SharedSparseVector` : its sorted `indices`,
+    their `values` (both read-only arrays), its `size` and `default` value,
+    and the `version` counting the publications before it.
+    """
+
+    __slots__ = ('indices', 'values', 'size', 'default', 'dtype', 'version')
+
+    def __init__(self, indices, values, size, default, dtype, version):
+        self.indices = _frozen(indices)
+        self.values = _frozen(values)
+        self.size = size
+        self.default = default
+        self.dtype = dtype
+        self.version = version
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('SparseVector index out of range')
+        k = np.searchsorted(self.indices, index)
+        if k < self.indices.size and self.indices[k] == index:
+            return self.values[k]
+        return self.default
+
+    def vector(self):
+        """
+        Return this snapshot as a `SparseVector` that shares its arrays,
+        and copies them when written to.
+        """
+        sv = SparseVector(self.size, default_value=self.default,
+                          dtype=self.dtype)
+        sv.indices = self.indices
+        sv.values = self.values
+        sv._shared = True  # copied on write
+        return sv
+
+
+class SharedSparseVector(object):
+    """
+    A vector that many threads read while others write it.
+
+        shared = SharedSparseVector(sv)
+        snapshot = shared.snapshot()  # never changes, whatever the writers do
+        with shared.batch() as sv:    # one writer at a time
+            sv[indices] = values
+            del sv[7]                 # both published at once, on exit
+
+    It starts as a copy of `arg` when given a `SparseVector`, or as the
+    vector made of the same arguments as `SparseVector`'s.
+    The single positions read straight from this vector are consistent on
+    their own; read a `snapshot()` to get several of them consistently.
+    """
+
+    def __init__(self, arg=0, default_value=0, size=None, dtype=np.float):
+        if isinstance(arg, SparseVector):
+            arg = arg.copy()
+        else:
+            arg = SparseVector(arg, default_value=default_value, size=size,
+                               dtype=dtype)
+        self._write_lock = threading.Lock()
+        self._snapshot = None
+        self.__publish(arg, 0)
+
+    def snapshot(self):
+        """
+        Return the current `Snapshot`, without waiting for the writers.
+        """
+        return self._snapshot  # replacing a reference is atomic
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def __len__(self):
+        return self._snapshot.size
+
+    def __getitem__(self, index):
+        return self._snapshot[index]
+
+    def __iter__(self):
+        return iter(self._snapshot.vector())
+
+    def vector(self):
+        """
+        Return the current state as a `SparseVector`, see `Snapshot.vector`.
+        """
+        return self._snapshot.vector()
+
+    def __publish(self, sv, version):
+        self._snapshot = Snapshot(sv.indices, sv.values, len(sv), sv.default,
+                                  sv.dtype, version)
+        sv._shared = True  # later writes to `sv` must not reach the snapshot
+
+    @contextmanager
+    def batch(self, buffered=True):
+        """
+        Yield a private `SparseVector` copy of the current state to write
+        to, and publish it as the new state when the block exits without
+        error. Writers wait for each other here, while readers keep on
+        reading the previous state. The arrays are copied once per batch
+        at most, and, when `buffered`, the scattered writes are staged and
+        merged once, like with `SparseVector.enable_write_buffer()`.
+        """
+        with self._write_lock:
+            current = self._snapshot
+            sv = current.vector()
+            if buffered:
+                sv.enable_write_buffer(threshold=np.iinfo(np.int32).max)
+            yield sv
+            sv.disable_write_buffer()
+            self.__publish(sv, current.version + 1)
+
+    def __setitem__(self, index, value):
+        with self.batch(buffered=False) as sv:
+            sv[index] = value
+
+    def __delitem__(self, index):
+        with self.batch(buffered=False) as sv:
+            del sv[index]
+
+    def update(self, indices, values):
+        """
+        Write the `values` at the `indices`, published at once.
+        """
+        with self.batch(buffered=False) as sv:
+            sv[indices] = values
+
+    def apply(self, delta):
+        """
+        Apply a `SparseDelta`, published at once.
+        """
+        with self.batch(buffered=False) as sv:
+            sv.apply(delta)
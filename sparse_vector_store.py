@@ -0,0 +1,399 @@
+"""
+
+Store many `SparseVector`s in a single append-only file, and load them back
+without copying : a vector read from the store is a view on the file mapped
+in memory, whose arrays are only copied when the vector is written to.
+
+Each vector is a record appended at the end of the file, its indices and
+values back to back, and an in-memory index maps each id to its record.
+Overwriting or deleting a vector (which appends a tombstone) leaves a dead
+record behind, which `compact()` reclaims, possibly in a background thread.
+
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+from six import text_type
+
+from sparse_vector import SparseVector
+
+
+_MAGIC = b'SVR1'
+# magic, flags, dtype length, id length, size, number of stored values
+_HEADER = struct.Struct('<4sBBHQQ')
+_TOMBSTONE = 1
+_ALIGNMENT = 8
+
+
+def _aligned(n):
+    return -(-n // _ALIGNMENT) * _ALIGNMENT
+
+
+def _padding(n):
+    return b'\0' * (_aligned(n) - n)
+
+
+def _encode_record(key, sv=None):
+    """
+    Return the bytes of the record of `sv` under `key`, or of the tombstone
+    of `key` without `sv`. Arrays start on 8 bytes boundaries.
+    """
+    if not isinstance(key, text_type):
+        raise TypeError('The ids of a store are text, not {}'.format(
+            type(key).__name__))
+    key = key.encode('utf-8')
+    if sv is None:
+        flags, size, default = _TOMBSTONE, 0, np.zeros(1, dtype=np.uint8)
+        indices = values = np.zeros(0, dtype=np.uint8)
+    else:
+        flags, size = 0, len(sv)
+        indices = np.asarray(sv.indices, dtype='<i8')
+        values = np.asarray(sv.values)
+        if values.dtype.hasobject:
+            raise TypeError('Cannot store values of dtype object')
+        default = np.array([sv.default], dtype=values.dtype)
+    descr = values.dtype.str.encode('ascii')
+    head = _HEADER.pack(_MAGIC, flags, len(descr), len(key), size,
+                        indices.size) + key + descr
+    return b''.join((head, _padding(len(head)),
+                     default.tobytes(), _padding(default.nbytes),
+                     indices.tobytes(),
+                     values.tobytes(), _padding(values.nbytes)))
+
+
+class _Record(object):
+    """
+    The layout of a record of the store, read from its header.
+    """
+
+    def __init__(self, buffer, offset):
+        magic, self.flags, descr_length, key_length, self.size, self.nnz = \
+            _HEADER.unpack_from(buffer, offset)
+        if magic != _MAGIC:
+            raise IOError('Corrupted store record at offset {}'.format(
+                offset))
+        start = offset + _HEADER.size
+        self.key = bytes(buffer[start:start + key_length]).decode('utf-8')
+        start += key_length
+        self.dtype = np.dtype(
+            bytes(buffer[start:start + descr_length]).decode('ascii'))
+        self.offset = offset
+        self.default_at = offset + _aligned(
+            _HEADER.size + key_length + descr_length)
+        self.indices_at = self.default_at + _aligned(self.dtype.itemsize)
+        self.values_at = self.indices_at + 8 * self.nnz
+        self.end = self.values_at + _aligned(self.nnz * self.dtype.itemsize)
+
+    @property
+    def deleted(self):
+        return bool(self.flags & _TOMBSTONE)
+
+    def vector(self, buffer):
+        """
+        Return the vector of this record, as a view on `buffer`.
+        """
+        default = np.frombuffer(buffer, dtype=self.dtype, count=1,
+                                offset=self.default_at)[0]
+        sv = SparseVector(int(self.size), default_value=default,
+                          dtype=self.dtype)
+        sv.indices = np.frombuffer(buffer, dtype='<i8', count=self.nnz,
+                                   offset=self.indices_at)
+        sv.values = np.frombuffer(buffer, dtype=self.dtype, count=self.nnz,
+                                  offset=self.values_at)
+        sv._shared = True  # copied on write
+        return sv
+
+
+class SparseVectorStore(object):
+    """
+    Many `SparseVector`s stored by id in the append-only file at `path`,
+    created when missing. The ids are text.
+
+        store = SparseVectorStore('vectors.svr')
+        store['doc-1'] = sv
+        sv = store['doc-1']  # mapped from the file, not copied
+
+    The store may be shared by threads. Vectors read from it stay valid
+    after it is closed or compacted : they keep their own map of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.garbage = 0  # bytes of the dead records
+        self._lock = threading.RLock()
+        self._index = {}  # id -> (start, end) of its record
+        self._map = None
+        self._file = open(path, 'a+b')
+        self.__scan(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._map = None  # closed once no vector uses it any more
+
+    @property
+    def nbytes(self):
+        """
+        The size of the file, dead records included.
+        """
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            return self._file.tell()
+
+    def __buffer(self, end):
+        """
+        Return a map of the file that reaches at least `end`, mapping again
+        the file when it grew since.
+        """
+        if self._map is None or len(self._map) < end:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        return self._map
+
+    def __scan(self, start):
+        """
+        Index the records from `start` to the end of the file, truncating
+        the file after the last whole record when a write was cut short.
+        """
+        end = self.nbytes
+        if end <= start:
+            return
+        buffer = self.__buffer(end)
+        offset = start
+        while offset < end:
+            if offset + _HEADER.size > end:
+                break
+            record = _Record(buffer, offset)
+            if record.end > end:
+                break
+            previous = self._index.pop(record.key, None)
+            if previous is not None:
+                self.garbage += previous[1] - previous[0]
+            if record.deleted:
+                self.garbage += record.end - record.offset
+            else:
+                self._index[record.key] = (record.offset, record.end)
+            offset = record.end
+        if offset < end:  # a torn record, whose vector would be cut short
+            buffer = self._map = None
+            self._file.truncate(offset)
+
+    def __append(self, key, data):
+        with self._lock:
+            offset = self.nbytes
+            self._file.write(data)
+            self.__scan(offset)
+
+    def __setitem__(self, key, sv):
+        self.__append(key, _encode_record(key, sv))
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._index:
+                raise KeyError(key)
+            self.__append(key, _encode_record(key))
+
+    def __getitem__(self, key):
+        with self._lock:
+            start, end = self._index[key]
+            buffer = self.__buffer(end)
+        return _Record(buffer, start).vector(buffer)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._index)
+
+    # Bulk loading
+
+    def __spans(self, keys, gap):
+        """
+        Return the `(start, end)` byte ranges covering the records of `keys`
+        in file order, records less than `gap` bytes apart being coalesced.
+        """
+        ranges = sorted(self._index[key] for key in keys)
+        spans = []
+        for start, end in ranges:
+            if spans and start - spans[-1][1] <= gap:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+        return spans
+
+    def prefetch(self, keys, gap=1 << 16):
+        """
+        Read ahead the records of `keys` into the page cache, in as few
+        sequential reads as possible. Returns the number of reads.
+        """
+        with self._lock:
+            spans = self.__spans(keys, gap)
+            if not spans:
+                return 0
+            buffer = self.__buffer(spans[-1][1])
+        for start, end in spans:
+            if hasattr(buffer, 'madvise'):
+                start -= start % mmap.PAGESIZE
+                buffer.madvise(mmap.MADV_WILLNEED, start, end - start)
+            else:
+                buffer[start:end]  # one sequential read
+        return len(spans)
+
+    def load_many(self, keys, prefetch=True):
+        """
+        Return the vectors of `keys`, in that order, their records being
+        read in file order.
+        """
+        keys = list(keys)
+        if prefetch:
+            self.prefetch(keys)
+        with self._lock:
+            ranges = [self._index[key] for key in keys]
+            buffer = self.__buffer(max(r[1] for r in ranges)) \
+                if ranges else None
+        order = sorted(range(len(keys)), key=lambda i: ranges[i][0])
+        vectors = [None] * len(keys)
+        for i in order:
+            vectors[i] = _Record(buffer, ranges[i][0]).vector(buffer)
+        return vectors
+
+    def iter_batches(self, keys, batch_size=256):
+        """
+        Yield the vectors of `keys` as lists of `batch_size` vectors, each
+        batch being prefetched in a background thread while the previous
+        one is being used.
+        """
+        keys = list(keys)
+        batches = [keys[i:i + batch_size]
+                   for i in range(0, len(keys), batch_size)]
+        if batches:
+            self.prefetch(batches[0])
+        for i, batch in enumerate(batches):
+            prefetcher = None
+            if i + 1 < len(batches):
+                prefetcher = threading.Thread(target=self.prefetch,
+                                              args=(batches[i + 1],))
+                prefetcher.daemon = True
+                prefetcher.start()
+            yield self.load_many(batch, prefetch=False)
+            if prefetcher is not None:
+                prefetcher.join()
+
+    def load_async(self, keys, executor=None):
+        """
+        Return an `asyncio` future of the vectors of `keys`, loaded in
+        `executor`, the default executor of the event loop when `None`.
+        Gather several of them to load batches concurrently.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(executor, self.load_many, list(keys))
+
+    def aiter_batches(self, keys, batch_size=256, executor=None):
+        """
+        Return an asynchronous iterator over the vectors of `keys`, as lists
+        of `batch_size` vectors, for use with `async for`. The next batch
+        is loaded while the current one is being used.
+        """
+        return _AsyncBatches(self, keys, batch_size, executor)
+
+    # Compaction
+
+    def compact(self, background=False):
+        """
+        Rewrite the file without its dead records. The live records are
+        copied in file order while the store remains usable, and the file
+        is swapped once the records written meanwhile are copied too.
+        In the `background`, return the started compaction thread.
+        """
+        if background:
+            thread = threading.Thread(target=self.compact)
+            thread.daemon = True
+            thread.start()
+            return thread
+
+        with self._lock:
+            end = self.nbytes
+            spans = self.__spans(list(self._index), 0)
+            buffer = self.__buffer(end) if end else None
+        path = self.path + '.compact'
+        with open(path, 'wb') as f:
+            for start, stop in spans:
+                f.write(memoryview(buffer)[start:stop])
+            with self._lock:
+                tail = self.nbytes
+                if tail > end:  # written during the compaction
+                    f.write(memoryview(self.__buffer(tail))[end:tail])
+                f.flush()
+                os.fsync(f.fileno())
+                self._file.close()
+                self._map = None
+                _replace(path, self.path)
+                self._file = open(self.path, 'a+b')
+                self._index = {}
+                self.garbage = 0
+                self.__scan(0)
+
+
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:  # Python 2
+        os.rename(source, destination)
+
+
+class _AsyncBatches(object):
+    """
+    The asynchronous iterator of `SparseVectorStore.aiter_batches()`.
+    """
+
+    def __init__(self, store, keys, batch_size, executor):
+        keys = list(keys)
+        self.store = store
+        self.executor = executor
+        self.batches = [keys[i:i + batch_size]
+                        for i in range(0, len(keys), batch_size)]
+        self.pending = None
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        if self.pending is None and self.batches:
+            self.pending = self.store.load_async(self.batches.pop(0),
+                                                 self.executor)
+        current = self.pending
+        if current is None:
+            current = asyncio.get_event_loop().create_future()
+            current.set_exception(StopAsyncIteration())
+        elif self.batches:
+            self.pending = self.store.load_async(self.batches.pop(0),
+                                                 self.executor)
+        else:
+            self.pending = None
+        return current
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 import unittest
+import warnings
 import numpy
 from future.builtins import range
-from sparse_vector import SparseVector
+import sparse_vector
+from sparse_vector import SparseVector, SparseDelta
 
 
 class TestSparseVector(unittest.TestCase):
@@ -186,6 +188,23 @@ class TestSparseVector(unittest.TestCase):
         del sv[3:5]
         self.assertEquals([0, 1, 2, 0, 0, 5, 6, 7, 8, 9], sv)
 
+    def test_strided_slice_removal(self):
+        for index in [slice(1, 9, 3), slice(8, 0, -2), slice(None, None, -3),
+                      slice(-2, None), slice(7, 2)]:
+            sv = SparseVector(range(1, 11), 0)
+            dense = list(range(1, 11))
+            for i in range(10)[index]:
+                dense[i] = 0
+            del sv[index]
+            self.assertEquals(dense, list(sv))
+
+    def test_huge_slice_removal_only_reads_stored_values(self):
+        sv = SparseVector({5: 1., 50: 2., 10 ** 8 - 1: 3.})
+        with sparse_vector.strict(max_bytes=10 ** 6):
+            del sv[10:10 ** 8 - 1]
+        self.assertEquals([5, 10 ** 8 - 1], list(sv.indices))
+        self.assertEquals(10 ** 8, len(sv))
+
     def test_append(self):
         sv = SparseVector(1, 0)
         sv.append(1)
@@ -345,5 +364,517 @@ class TestSparseVector(unittest.TestCase):
         sv.remove(1)
         self.assertEquals([1, 1, 1, 1], sv)
 
+    def test_indices_are_kept_sorted(self):
+        sv = SparseVector(10)
+        sv[7], sv[2], sv[5] = 1, 2, 3
+        sv[[9, 0, 5]] = [4, 5, 6]
+        self.assertEquals([0, 2, 5, 7, 9], list(sv.indices))
+        self.assertEquals([5, 2, 6, 1, 4], list(sv.values))
+
+    def test_set_with_duplicate_indices_keeps_last(self):
+        sv = SparseVector(4)
+        sv[[1, 2, 1]] = [5, 6, 7]
+        self.assertEquals([0, 7, 6, 0], sv)
+
+    def test_index_value_is_lowest_position(self):
+        sv = SparseVector({4: 1, 0: 1}, 0)
+        self.assertEquals(0, sv.index(1))
+
+    def test_write_buffer_reads_see_staged_writes(self):
+        sv = SparseVector(10)
+        buffer = sv.enable_write_buffer(threshold=100)
+        sv[3], sv[8] = 1, 2
+        self.assertEquals(1, sv[3])
+        self.assertEquals(0, sv[4])
+        self.assertEquals(2, len(buffer))
+        self.assertEquals(0, buffer.stats()['merges'])
+        self.assertEquals([0, 0, 0, 1, 0, 0, 0, 0, 2, 0], sv)
+        self.assertEquals(0, len(buffer))
+        self.assertEquals(1, buffer.stats()['read_merges'])
+
+    def test_write_buffer_merges_at_threshold(self):
+        sv = SparseVector(0)
+        buffer = sv.enable_write_buffer(threshold=4)
+        for i in (9, 3, 5, 3, 1):
+            sv[i] = i
+        self.assertEquals(1, buffer.stats()['merges'])
+        self.assertEquals(4, buffer.stats()['merged'])
+        self.assertEquals(5, buffer.stats()['staged'])
+        self.assertEquals(10, len(sv))
+        sv.flush()
+        self.assertEquals([1, 3, 5, 9], list(sv.indices))
+
+    def test_write_buffer_batched_writes(self):
+        sv = SparseVector([1, 2, 3, 4])
+        buffer = sv.enable_write_buffer(threshold=3)
+        sv[[0, 6]] = [7, 8]
+        self.assertEquals(7, len(sv))
+        self.assertEquals(0, buffer.stats()['merges'])
+        sv[[1, 2, 3]] = 9
+        self.assertEquals(1, buffer.stats()['merges'])
+        self.assertEquals([7, 9, 9, 9, 0, 0, 8], sv)
+
+    def test_write_buffer_disable(self):
+        sv = SparseVector(3)
+        sv.enable_write_buffer()
+        sv[1] = 5
+        sv.append(6)
+        sv.disable_write_buffer()
+        self.assertEquals(None, sv.write_buffer)
+        self.assertEquals([1, 3], list(sv.indices))
+        self.assertEquals([0, 5, 0, 6], sv)
+
+    def test_accumulate_add(self):
+        sv = SparseVector([1, 0, 2])
+        sv.accumulate([0, 4, 0, 1], [1, 2, 3, 4])
+        self.assertEquals([5, 4, 2, 0, 2], sv)
+
+    def test_accumulate_single_value(self):
+        sv = SparseVector(3, dtype=int)
+        sv.accumulate([2, 2, 0], 1)
+        self.assertEquals([1, 0, 2], sv)
+
+    def test_accumulate_max_and_min(self):
+        sv = SparseVector([5, 0, 5], default_value=3)
+        sv.accumulate([0, 1, 1, 3], [7, 1, 2, 9], op='max')
+        self.assertEquals([7, 2, 5, 9], sv)
+        sv.accumulate([0, 1, 4], [6, 8, 1], op='min')
+        self.assertEquals([6, 2, 5, 9, 1], sv)
+
+    def test_accumulate_negative_out_of_range(self):
+        sv = SparseVector(5)
+        sv.accumulate([-1], [2.])
+        self.assertRaises(IndexError, sv.accumulate, [-9], [1.])
+        self.assertEquals([0, 0, 0, 0, 2.], sv)
+
+    def test_accumulate_unknown_op(self):
+        sv = SparseVector(3)
+        self.assertRaises(ValueError, sv.accumulate, [0], [1], op='mean')
+
+    def test_accumulate_through_write_buffer(self):
+        sv = SparseVector(3)
+        sv.enable_write_buffer()
+        sv[1] = 2
+        sv.accumulate([1, 2], [3, 4])
+        self.assertEquals([0, 5, 4], sv)
+
+    def test_from_counts(self):
+        sv = SparseVector.from_counts([3, 1, 3, 3, 7])
+        self.assertEquals(8, len(sv))
+        self.assertEquals([0, 1, 0, 3, 0, 0, 0, 1], sv)
+        self.assertEquals([1, 3, 7], list(sv.indices))
+
+    def test_from_counts_with_weights_and_size(self):
+        sv = SparseVector.from_counts([2, 0, 2], weights=[.5, 1, .25],
+                                      size=5)
+        self.assertEquals([1, 0, .75, 0, 0], sv)
+
+    def test_track_densify(self):
+        sv = SparseVector(1000)
+        with sparse_vector.track() as counts:
+            list(sv)
+            repr(sv)
+            numpy.array(sv)
+            sv == SparseVector(1000)
+        self.assertEquals(5, counts['densify_calls'])
+        self.assertEquals(5 * 8000, counts['densify_bytes'])
+
+    def test_track_reallocations_and_lookups(self):
+        sv = SparseVector(10)
+        with sparse_vector.track() as counts:
+            sv[3] = 1
+            sv[3] = 2
+            sv[[5, 6]] = 3
+            del sv[5]
+            sv[4]
+        self.assertEquals(3, counts['reallocations'])
+        self.assertEquals(4, counts['lookups'])
+        self.assertEquals(0, counts['densify_calls'])
+
+    def test_stats_are_off_by_default(self):
+        before = sparse_vector.stats()
+        SparseVector(10).densify()
+        self.assertEquals(before, sparse_vector.stats())
+
+    def test_strict_raises(self):
+        sv = SparseVector(1000)
+        sv[3] = 1
+        with sparse_vector.strict(max_bytes=1000):
+            self.assertEquals(1, sv[3])
+            self.assertRaises(sparse_vector.DensifyError, list, sv)
+            self.assertRaises(sparse_vector.DensifyError, repr, sv)
+            self.assertRaises(sparse_vector.DensifyError, numpy.array, sv)
+        self.assertEquals(1000, len(list(sv)))
+
+    def test_strict_warns(self):
+        sv = SparseVector(1000)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with sparse_vector.strict(max_bytes=1000, action='warn'):
+                sv.densify()
+                SparseVector(10).densify()
+        caught = [w for w in caught
+                  if issubclass(w.category, sparse_vector.DensifyWarning)]
+        self.assertEquals(1, len(caught))
+
+    def test_slice_is_a_view(self):
+        sv = SparseVector({2: 1., 5: 2., 9: 3.}, size=12)
+        view = sv[4:10]
+        self.assertTrue(isinstance(view, SparseVector))
+        self.assertEquals(6, len(view))
+        self.assertEquals([0, 2, 0, 0, 0, 3], view)
+        self.assertEquals(2., view[1])
+        self.assertEquals(3., view[-1])
+        self.assertTrue(numpy.shares_memory(view.values, sv.values))
+
+    def test_slice_of_a_view(self):
+        sv = SparseVector(range(10))
+        self.assertEquals([3, 4, 5], sv[2:8][1:4])
+        self.assertEquals([5], sv[2:8][3:4][:])
+
+    def test_slice_view_copy_on_write(self):
+        sv = SparseVector([1, 2, 3, 4, 5])
+        view = sv[1:4]
+        view[0] = 9
+        view[1] = 0
+        self.assertEquals([1, 2, 3, 4, 5], sv)
+        self.assertEquals([9, 0, 4], view)
+        view = sv[1:4]
+        sv[2] = 7
+        del sv[3]
+        self.assertEquals([2, 3, 4], view)
+        self.assertEquals([1, 2, 7, 0, 5], sv)
+
+    def test_slice_with_step_is_sparse(self):
+        sv = SparseVector({1: 1, 4: 4, 5: 5, 8: 8}, size=10)
+        self.assertEquals([1, 0, 5, 0], sv[1:9:2])
+        self.assertEquals([0, 0, 5, 0], sv[-1:2:-2])
+        self.assertEquals([0, 8, 0, 0, 5, 4, 0, 0, 1, 0], sv[::-1])
+        self.assertTrue(isinstance(sv[::-1], SparseVector))
+
+    def test_copy(self):
+        sv = SparseVector({1: 1, 4: 4}, size=6, default_value=-1)
+        copy = sv.copy()
+        copy[1] = 2
+        self.assertEquals([-1, 1, -1, -1, 4, -1], sv)
+        self.assertEquals([-1, 2, -1, -1, 4, -1], copy)
+        self.assertFalse(numpy.shares_memory(copy.values, sv.values))
+
+    def test_index_in_range(self):
+        sv = SparseVector({2: 5, 3: 5, 4: 1, 9: 5}, size=12)
+        self.assertEquals(2, sv.index(5))
+        self.assertEquals(3, sv.index(5, 3))
+        self.assertEquals(9, sv.index(5, 4, 10))
+        self.assertRaises(ValueError, sv.index, 5, 4, 9)
+        self.assertEquals(0, sv.index(0))
+        self.assertEquals(5, sv.index(0, 2))
+        self.assertEquals(10, sv.index(0, 9))
+        self.assertEquals(10, sv.index(0, -2))
+
+    def test_index_default_value_stored_explicitly(self):
+        sv = SparseVector([1, 0, 2, 3])
+        self.assertEquals(1, sv.index(0))
+        sv = SparseVector([1, 2, 3, 4], default_value=3)
+        self.assertEquals(2, sv.index(3))
+
+    def test_find_all(self):
+        sv = SparseVector({2: 5, 3: 5, 4: 0, 9: 5}, size=12)
+        self.assertEquals([2, 3, 9], list(sv.find_all(5)))
+        self.assertEquals([3], list(sv.find_all(5, 3, 9)))
+        self.assertEquals([0, 1, 4, 5, 6, 7, 8, 10, 11],
+                          list(sv.find_all(0)))
+        self.assertEquals([4, 5, 6, 7], list(sv.find_all(0, 3, 8)))
+        self.assertEquals([], list(sv.find_all(7)))
+
+    def test_find_all_defaults_is_strict(self):
+        sv = SparseVector(1000)
+        with sparse_vector.strict(max_bytes=1000):
+            self.assertEquals([], list(sv.find_all(1)))
+            self.assertRaises(sparse_vector.DensifyError, sv.find_all, 0)
+
+    def test_where(self):
+        sv = SparseVector({1: 5., 3: -1., 4: 2.}, size=6)
+        positive = sv.where(lambda v: v > 0)
+        self.assertEquals(bool, type(positive.default))
+        self.assertEquals([1, 4], list(positive.indices))
+        self.assertEquals([False, True, False, False, True, False],
+                          list(positive))
+        not_positive = sv.where(lambda v: v <= 0)
+        self.assertEquals(True, not_positive.default)
+        self.assertEquals([1, 4], list(not_positive.indices))
+        self.assertEquals(2, sv.where(numpy.isfinite).count(True, 0, 2))
+        view = SparseVector({3: 5., 7: 1., 9: 8.})[2:10]
+        large = view.where(lambda v: v > 2)
+        self.assertEquals([1, 7], list(large.indices))
+        self.assertEquals([False, True] + [False] * 5 + [True],
+                          list(large.densify()))
+
+    def test_count_in_range(self):
+        sv = SparseVector({2: 5, 3: 5, 4: 1, 9: 5}, size=12)
+        self.assertEquals(3, sv.count(5))
+        self.assertEquals(1, sv.count(5, 3, 9))
+        self.assertEquals(8, sv.count(0))
+        self.assertEquals(4, sv.count(0, 4, 10))
+
+    def test_sort(self):
+        sv = SparseVector({1: 3., 3: -1., 4: 2., 6: -5., 7: 0.}, size=9)
+        sv.sort()
+        self.assertEquals([-5, -1, 0, 0, 0, 0, 0, 2, 3], sv)
+        self.assertEquals([0, 1, 7, 8], list(sv.indices))
+        sv.sort(reverse=True)
+        self.assertEquals([3, 2, 0, 0, 0, 0, 0, -1, -5], sv)
+
+    def test_sort_with_nan(self):
+        sv = SparseVector({1: numpy.nan, 3: -1.}, size=4, default_value=1.)
+        sv.sort()
+        self.assertEquals('[-1.0, 1.0, 1.0, nan]', repr(sv))
+
+    def test_argsort(self):
+        sv = SparseVector({1: 3., 3: -1., 4: 2., 6: -1., 7: 0.}, size=9)
+        dense = sv.densify()
+        self.assertEquals(list(numpy.argsort(dense, kind='mergesort')),
+                          list(sv.argsort()))
+        lower, runs, greater = sv.argsort(runs=True)
+        self.assertEquals([3, 6], list(lower))
+        self.assertEquals([[0, 1], [2, 3], [5, 6], [7, 9]], runs.tolist())
+        self.assertEquals([4, 1], list(greater))
+
+    def test_unique(self):
+        sv = SparseVector({1: 3., 3: -1., 4: 3., 5: 0.}, size=8)
+        self.assertEquals([-1, 0, 3], list(sv.unique()))
+        values, counts = sv.unique(return_counts=True)
+        self.assertEquals([-1, 0, 3], list(values))
+        self.assertEquals([1, 5, 2], list(counts))
+        values, counts = SparseVector([1, 2]).unique(return_counts=True)
+        self.assertEquals([1, 1], list(counts))
+
+    def test_top_k_and_bottom_k(self):
+        sv = SparseVector({1: 3., 3: -1., 4: 2., 6: -5., 7: 3.}, size=9)
+        positions, values = sv.top_k(3)
+        self.assertEquals([1, 7, 4], list(positions))
+        self.assertEquals([3, 3, 2], list(values))
+        positions, values = sv.top_k(5)
+        self.assertEquals([1, 7, 4, 0, 2], list(positions))
+        self.assertEquals([3, 3, 2, 0, 0], list(values))
+        positions, values = sv.bottom_k(3)
+        self.assertEquals([6, 3, 0], list(positions))
+        self.assertEquals([-5, -1, 0], list(values))
+        self.assertEquals(9, len(sv.top_k(20)[0]))
+
+    def test_top_k_ties_across_k(self):
+        sv = SparseVector([5., 1.] + [5.] * 18)
+        self.assertEquals([0], list(sv.top_k(1)[0]))
+        self.assertEquals([0, 2], list(sv.top_k(2)[0]))
+        self.assertEquals([1, 0, 2], list(sv.bottom_k(3)[0]))
+        sv = SparseVector({3: 2., 5: 1., 8: 2., 9: 1.}, size=12)
+        self.assertEquals([3, 8, 5], list(sv.top_k(3)[0]))
+        self.assertEquals([0, 1], list(sv.bottom_k(2)[0]))
+        sv = SparseVector([numpy.nan, 2., numpy.nan, 2.])
+        self.assertEquals([0, 2, 1], list(sv.top_k(3)[0]))
+        self.assertEquals([1, 3, 0], list(sv.bottom_k(3)[0]))
+
+    def test_top_k_of_huge_gaps(self):
+        sv = SparseVector({10 ** 9: 1.}, default_value=2.)
+        positions, values = sv.top_k(2)
+        self.assertEquals([0, 1], list(positions))
+        self.assertEquals([10 ** 9], list(sv.bottom_k(1)[0]))
+
+    def test_reversed_is_sparse(self):
+        sv = SparseVector({1: 1}, size=4)
+        with sparse_vector.track() as counts:
+            self.assertEquals([0, 0, 1, 0], list(reversed(sv)))
+        self.assertEquals(0, counts['lookups'])
+
+    def test_diff_and_apply(self):
+        rng = numpy.random.RandomState(3)
+        for default in [0, 1.5]:
+            old = SparseVector(dict(zip(rng.randint(0, 50, 20),
+                                        rng.rand(20))), size=50)
+            new = old.copy()
+            new[[3, 7, 49]] = [1., 2., 3.]
+            del new[old.indices[5]]
+            new.default = default
+            new.size = 60
+            delta = new.diff(old)
+            self.assertTrue(len(delta) <= 4)
+            old.apply(delta)
+            self.assertEquals(60, len(old))
+            self.assertEquals(list(new), list(old))
+
+    def test_diff_of_equal_vectors_is_empty(self):
+        sv = SparseVector({1: 2, 5: 3}, size=8)
+        self.assertEquals(0, len(sv.diff(sv.copy())))
+
+    def test_delta_bytes_round_trip(self):
+        old = SparseVector({i: 1. for i in range(0, 10 ** 6, 1000)})
+        new = old.copy()
+        new[[5, 10 ** 6 - 1]] = [2., 3.]
+        del new[2000]
+        data = new.diff(old).to_bytes()
+        self.assertTrue(len(data) < 100)
+        old.apply(SparseDelta.from_bytes(data))
+        self.assertEquals(list(new.indices), list(old.indices))
+        self.assertEquals(list(new.values), list(old.values))
+
+    def test_delta_bytes_of_objects(self):
+        sv = SparseVector({1: 'a'}, size=3, dtype=object)
+        delta = sv.diff(SparseVector(3, dtype=object))
+        self.assertRaises(TypeError, delta.to_bytes)
+        self.assertRaises(ValueError, SparseDelta.from_bytes, b'x' * 40)
+
+    def test_version_counts_changes(self):
+        sv = SparseVector({1: 2.}, size=5)
+        versions = [sv.version]
+        for change in [lambda: sv.__setitem__(3, 1.),
+                       lambda: sv.__setitem__(3, 4.),
+                       lambda: sv.__delitem__(1),
+                       lambda: sv.append(7.),
+                       lambda: sv.extend([8.]),
+                       lambda: sv.remove(7.),
+                       lambda: sv.pop(),
+                       lambda: sv.accumulate([3], [1.])]:
+            change()
+            versions.append(sv.version)
+        self.assertEquals(sorted(set(versions)), versions)
+        sv[0]
+        sv.sum()
+        self.assertEquals(versions[-1], sv.version)
+
+    def test_statistics_are_memoized_per_version(self):
+        sv = SparseVector({1: 3., 2: 4.}, size=4, default_value=0)
+        self.assertEquals(5., sv.norm())
+        self.assertTrue(sv.norm() is sv.norm())
+        self.assertEquals(7., sv.sum())
+        sv[0] = -1.
+        self.assertEquals(6., sv.sum())
+        self.assertEquals(3, sv.nnz)
+        sv.enable_write_buffer()
+        sv[3] = 10.
+        self.assertEquals(16., sv.sum())
+        self.assertEquals(10., sv.max())
+        self.assertEquals(4, sv.nnz)
+        sv.default = 1.
+        sv.size = 6
+        self.assertEquals(18., sv.sum())
+        self.assertEquals(-1., sv.min())
+
+    def test_content_hash(self):
+        a = SparseVector({1: 3., 2: 4.}, size=4)
+        b = SparseVector(4)
+        b[[2, 1]] = [4., 3.]
+        self.assertEquals(a.content_hash(), b.content_hash())
+        self.assertEquals(a.content_hash(), b[0:4].content_hash())
+        b[3] = 1.
+        self.assertNotEquals(a.content_hash(), b.content_hash())
+        b = a.copy()
+        b.default = 1
+        self.assertNotEquals(a.content_hash(), b.content_hash())
+
+    def test_freeze(self):
+        sv = SparseVector({1: 3., 2: 4.}, size=4).freeze()
+        self.assertTrue(sv.frozen)
+        version = sv.version
+        for change in [lambda: sv.__setitem__(1, 1.),
+                       lambda: sv.__setitem__([0, 3], 1.),
+                       lambda: sv.__delitem__(2),
+                       lambda: sv.append(1.),
+                       lambda: sv.pop(),
+                       lambda: sv.remove(3.),
+                       lambda: sv.sort(),
+                       lambda: sv.accumulate([1], [1.]),
+                       lambda: setattr(sv, 'default', 2.)]:
+            self.assertRaises(ValueError, change)
+        self.assertEquals([0, 3., 4., 0], list(sv))
+        self.assertEquals(version, sv.version)
+        self.assertRaises(ValueError, sv.values.__setitem__, 0, 1.)
+        view = sv[1:3]
+        view[1] = 5.
+        copy = sv.copy()
+        copy[0] = 1.
+        self.assertEquals([0, 3., 4., 0], list(sv))
+        self.assertEquals(7., sv.sum())
+
+    def test_matmul(self):
+        rng = numpy.random.RandomState(0)
+        W = rng.rand(50, 7)
+        for default in [0., 0.5]:
+            sv = SparseVector({3: 2., 17: -1., 49: 4.}, size=50,
+                              default_value=default)
+            expected = numpy.dot(sv.densify(), W)
+            numpy.testing.assert_allclose(expected, sv.matmul(W))
+            numpy.testing.assert_allclose(expected, sv.__matmul__(W))
+            numpy.testing.assert_allclose(
+                expected, sv.matmul(W, sums=W.sum(axis=0), workers=3))
+            expected = numpy.dot(W.T, sv.densify())
+            numpy.testing.assert_allclose(
+                expected, sparse_vector.dot_sparse(W.T, sv))
+            numpy.testing.assert_allclose(
+                expected, sparse_vector.dot_sparse(W.T, sv, workers=3))
+        self.assertRaises(AssertionError, sv.matmul, W.T)
+
+    def test_matmul_reads_only_the_stored_rows(self):
+        W = numpy.full((4, 2), numpy.nan)
+        W[1] = [1., 2.]
+        sv = SparseVector({1: 3.}, size=4)
+        self.assertEquals([3., 6.], list(sv.matmul(W)))
+
+    def test_reduce_bins(self):
+        sv = SparseVector({1: 4., 2: -2., 9: 6.}, size=11, default_value=1.)
+        dense = sv.densify()
+        for op, reduce in [('sum', numpy.sum), ('mean', numpy.mean),
+                           ('max', numpy.max), ('min', numpy.min)]:
+            bins = sv.reduce_bins(4, op)
+            self.assertEquals(3, len(bins))
+            numpy.testing.assert_allclose(
+                [reduce(dense[i:i + 4]) for i in range(0, 11, 4)],
+                bins.densify())
+        sums = SparseVector({10 ** 9: 2.}, default_value=1.,
+                            size=2 * 10 ** 9).reduce_bins(10)
+        self.assertEquals(1, sums.indices.size)
+        self.assertEquals(10., sums.default)
+        self.assertEquals(11., sums[10 ** 8])
+        self.assertEquals([2, 0, 1], list(sv.reduce_bins(4, 'count')))
+        self.assertEquals([0, 0, 0], list(SparseVector(9).reduce_bins(4)))
+        self.assertEquals([8, 8, 3], list(SparseVector(
+            19, default_value=1).reduce_bins(8)))
+        self.assertRaises(ValueError, sv.reduce_bins, 4, 'median')
+
+    def test_reduceat(self):
+        sv = SparseVector({1: 4., 2: -2., 9: 6.}, size=11, default_value=1.)
+        boundaries = [0, 2, 3, 8]
+        dense = sv.densify()
+        for op in ['sum', 'max', 'min']:
+            numpy.testing.assert_allclose(
+                getattr(numpy, {'sum': 'add', 'max': 'maximum',
+                                'min': 'minimum'}[op]).reduceat(dense,
+                                                                boundaries),
+                sv.reduceat(boundaries, op))
+        numpy.testing.assert_allclose([2.5, -2., 1., 8. / 3],
+                                      sv.reduceat(boundaries, 'mean'))
+        self.assertEquals([1, 1, 0, 1],
+                          list(sv.reduceat(boundaries, 'count')))
+
+    def test_cumsum_and_rolling_sum(self):
+        for default in [0., 1.5]:
+            sv = SparseVector({2: 4., 3: -2., 9: 6.}, size=12,
+                              default_value=default)
+            dense = sv.densify()
+            runs = sv.cumsum()
+            self.assertEquals(4, runs.runs)
+            numpy.testing.assert_allclose(numpy.cumsum(dense),
+                                          runs.densify())
+            self.assertAlmostEqual(numpy.cumsum(dense)[-1], runs[-1])
+            for window in [1, 3, 20]:
+                expected = [dense[max(0, i - window + 1):i + 1].sum()
+                            for i in range(12)]
+                numpy.testing.assert_allclose(
+                    expected, numpy.array(sv.rolling_sum(window)))
+        runs = SparseVector({10 ** 9: 1.}, size=2 * 10 ** 9).rolling_sum(10)
+        self.assertEquals(4, runs.runs)
+        self.assertEquals([0, 1, 1, 0], list(runs.take(
+            [10 ** 9 - 1, 10 ** 9, 10 ** 9 + 9, 10 ** 9 + 10])))
+        self.assertRaises(IndexError, runs.__getitem__, 2 * 10 ** 9)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy
+from sparse_vector import SparseVector
+from sparse_vector_blocks import BlockSparseVector, ArrayContainer, \
+    BitmapContainer, RunContainer
+
+
+class TestBlockSparseVector(unittest.TestCase):
+
+    def setUp(self):
+        # a run, a few scattered values and an irregular dense chunk
+        rng = numpy.random.RandomState(42)
+        run = numpy.arange(100, 400)
+        scattered = numpy.array([70000, 70003, 80000])
+        dense = 2 * 65536 + numpy.unique(rng.randint(0, 65536, 20000))
+        self.indices = numpy.concatenate((run, scattered, dense))
+        self.values = rng.rand(self.indices.size)
+        self.size = 4 * 65536
+        self.dense = numpy.zeros(self.size)
+        self.dense[self.indices] = self.values
+        self.blocks = BlockSparseVector(self.indices, self.values,
+                                        size=self.size)
+
+    def test_containers_are_chosen_by_fill(self):
+        containers = [type(c) for c in self.blocks.containers]
+        self.assertEqual([RunContainer, ArrayContainer, BitmapContainer],
+                         containers)
+        self.assertEqual([0, 1, 2], list(self.blocks.keys))
+
+    def test_nnz_and_nbytes(self):
+        self.assertEqual(self.indices.size, self.blocks.nnz)
+        flat = self.indices.nbytes + self.values.nbytes
+        self.assertTrue(self.blocks.nbytes < flat)
+
+    def test_random_access(self):
+        for i in [0, 99, 100, 250, 399, 400, 70000, 70001, 70003, 80000,
+                  2 * 65536 + 17, self.size - 1, -1]:
+            self.assertEqual(self.dense[i], self.blocks[i])
+
+    def test_numpy_integer_positions(self):
+        blocks = BlockSparseVector(numpy.arange(1, 4000, 2), numpy.ones(2000),
+                                   chunk_bits=12)
+        self.assertEqual(BitmapContainer, type(blocks.containers[0]))
+        for i in numpy.arange(0, 4000, dtype=numpy.int64)[::37]:
+            self.assertEqual(i % 2, blocks[i])
+        self.assertEqual(1, blocks[numpy.int64(3)])
+        self.assertEqual(1000, blocks.densify(0, numpy.int64(2000)).sum())
+
+    def test_take(self):
+        positions = numpy.arange(0, self.size, 7)
+        numpy.testing.assert_array_equal(self.dense[positions],
+                                         self.blocks.take(positions))
+
+    def test_take_unordered_across_chunks(self):
+        rng = numpy.random.RandomState(1)
+        positions = rng.randint(-self.size, self.size, (40, 50))
+        numpy.testing.assert_array_equal(self.dense[positions],
+                                         self.blocks.take(positions))
+        empty = BlockSparseVector([], [], size=10)
+        self.assertEqual([0, 0], list(empty.take([3, 9])))
+
+    def test_items_in_window(self):
+        indices, values = self.blocks.items(350, 2 * 65536 + 100)
+        keep = (self.indices >= 350) & (self.indices < 2 * 65536 + 100)
+        numpy.testing.assert_array_equal(self.indices[keep], indices)
+        numpy.testing.assert_array_equal(self.values[keep], values)
+
+    def test_densify_whole(self):
+        numpy.testing.assert_array_equal(self.dense, self.blocks.densify())
+
+    def test_densify_window(self):
+        for start, stop in [(0, 10), (150, 70001), (380, 2 * 65536 + 5),
+                            (2 * 65536 + 5, self.size)]:
+            numpy.testing.assert_array_equal(
+                self.dense[start:stop], self.blocks.densify(start, stop))
+
+    def test_densify_with_default(self):
+        blocks = BlockSparseVector([1, 2, 3], [5, 6, 7], default_value=-1,
+                                   size=6, chunk_bits=2)
+        self.assertEqual([-1, 5, 6, 7, -1, -1], list(blocks.densify()))
+
+    def test_unsorted_input(self):
+        blocks = BlockSparseVector([9, 2, 5], [1, 2, 3], chunk_bits=2)
+        self.assertEqual([0, 0, 2, 0, 0, 3, 0, 0, 0, 1],
+                         list(blocks.densify()))
+
+    def test_merge(self):
+        other = BlockSparseVector([5, 300, 3 * 65536], [1, 2, 3],
+                                  size=self.size)
+        merged = self.blocks.merge(other)
+        expected = self.dense.copy()
+        expected[[5, 300, 3 * 65536]] = [1, 2, 3]
+        numpy.testing.assert_array_equal(expected, merged.densify())
+        self.assertTrue(merged.containers[-2] is self.blocks.containers[-1])
+
+    def test_merge_with_op(self):
+        a = BlockSparseVector([0, 1, 2], [1, 2, 3], chunk_bits=2)
+        b = BlockSparseVector([2, 3, 9], [10, 20, 30], chunk_bits=2)
+        merged = a.merge(b, op=numpy.add)
+        self.assertEqual([1, 2, 13, 20, 0, 0, 0, 0, 0, 30],
+                         list(merged.densify()))
+
+    def test_round_trip_with_sparse_vector(self):
+        sv = SparseVector((self.indices, self.values), size=self.size)
+        blocks = sv.to_blocks(chunk_bits=12)
+        numpy.testing.assert_array_equal(self.dense, blocks.densify())
+        back = blocks.to_sparse_vector()
+        self.assertEqual(self.size, len(back))
+        numpy.testing.assert_array_equal(self.dense, back.densify())
+
+    def test_empty(self):
+        blocks = BlockSparseVector([], [], size=3)
+        self.assertEqual(0, blocks.nnz)
+        self.assertEqual([0, 0, 0], list(blocks.densify()))
+        self.assertEqual(0, blocks[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+from sparse_vector import SparseVector
+from sparse_vector_cache import SparseVectorCache
+
+
+def vector(nnz):
+    return SparseVector(dict((i, 1.) for i in range(nnz)), size=1000)
+
+
+class TestSparseVectorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+    def load(self, key):
+        self.loaded.append(key)
+        if key < 0:
+            raise KeyError(key)
+        return vector(key)
+
+    def test_nbytes(self):
+        self.assertEqual(0, SparseVector(10).nbytes)
+        self.assertEqual(3 * 16, vector(3).nbytes)
+
+    def test_hits_and_misses(self):
+        cache = SparseVectorCache(self.load)
+        self.assertEqual(list(vector(2)), list(cache[2]))
+        self.assertTrue(cache[2] is cache[2])
+        self.assertEqual([2], self.loaded)
+        stats = cache.stats()
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(32, stats['nbytes'])
+        self.assertRaises(KeyError, cache.get, -1)
+        self.assertFalse(-1 in cache)
+
+    def test_lru_eviction_under_budget(self):
+        cache = SparseVectorCache(self.load, max_bytes=5 * 16)
+        cache[2], cache[1], cache[2], cache[2]
+        cache[3]  # evicts 1, the least recently used
+        self.assertEqual([2, 3], sorted(k for k in (1, 2, 3) if k in cache))
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(16, cache.evicted_bytes)
+        self.assertEqual(80, cache.nbytes)
+        cache[10]  # larger than the whole budget
+        self.assertFalse(10 in cache)
+        self.assertEqual(80, cache.nbytes)
+
+    def test_size_aware_eviction(self):
+        cache = SparseVectorCache(self.load, max_bytes=10 * 16,
+                                  policy='size')
+        for key in (6, 1, 2):
+            cache[key]
+        cache[3]  # evicts the large one rather than the older small ones
+        self.assertFalse(6 in cache)
+        self.assertTrue(1 in cache and 2 in cache and 3 in cache)
+        self.assertRaises(ValueError, SparseVectorCache, policy='random')
+
+    def test_put_and_discard(self):
+        cache = SparseVectorCache()
+        cache.put('a', vector(1))
+        cache.put('a', vector(2))
+        self.assertEqual(32, cache.nbytes)
+        cache.discard('a')
+        self.assertEqual(0, cache.nbytes)
+        self.assertEqual(0, len(cache))
+
+    def test_concurrent_loads_are_coalesced(self):
+        def slow_load(key):
+            time.sleep(.05)
+            return self.load(key)
+        cache = SparseVectorCache(slow_load)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache[4]))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([4], self.loaded)
+        self.assertEqual(5, len(results))
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(4, cache.coalesced)
+
+
+if __name__ == '__main__':
+    unittest.main()
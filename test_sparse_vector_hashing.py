@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy
+from sparse_vector import SparseVector, SparseVectorBatch, dot_sparse
+from sparse_vector_hashing import HashingVectorizer, murmurhash3_32
+
+
+class TestMurmurHash(unittest.TestCase):
+
+    def test_reference_values(self):
+        keys = [b'', b'hello', b'abc', b'abcd', b'hello world']
+        expected = [0, 0x248bfa47, 0xb3dd93fa, 0x43ed676a, 0x5e928f0f]
+        self.assertEqual(expected, list(murmurhash3_32(keys)))
+
+    def test_seed(self):
+        self.assertEqual(0x514e28b7, murmurhash3_32([b''], seed=1)[0])
+
+    def test_text_is_hashed_as_utf_32(self):
+        words = [u'caf\xe9', u'ab', u'']
+        encoded = [w.encode('utf-32-le') for w in words]
+        self.assertEqual(list(murmurhash3_32(encoded)),
+                         list(murmurhash3_32(words)))
+
+    def test_not_text(self):
+        self.assertRaises(TypeError, murmurhash3_32, [1, 2])
+
+
+class TestHashingVectorizer(unittest.TestCase):
+
+    def test_transform_counts_tokens(self):
+        hv = HashingVectorizer(size=2 ** 20, alternate_sign=False)
+        sv, = hv.transform([['a', 'b', 'a']])
+        positions, _ = hv.hash(['a', 'b'])
+        self.assertEqual(2 ** 20, len(sv))
+        self.assertEqual(2, sv[positions[0]])
+        self.assertEqual(1, sv[positions[1]])
+        self.assertEqual(2, sv.indices.size)
+
+    def test_alternate_sign(self):
+        hv = HashingVectorizer(size=1000)
+        hashes = murmurhash3_32(['x', 'y', 'z', 'w'])
+        positions, signs = hv.hash(['x', 'y', 'z', 'w'])
+        numpy.testing.assert_array_equal(
+            numpy.where(hashes >= 2 ** 31, -1, 1), signs)
+        numpy.testing.assert_array_equal((hashes & 0x7fffffff) % 1000,
+                                         positions)
+
+    def test_collisions_add_up(self):
+        hv = HashingVectorizer(size=1, alternate_sign=False)
+        sv, = hv.transform([['a', 'b', 'c']])
+        self.assertEqual([3], sv)
+
+    def test_weights_and_strings(self):
+        hv = HashingVectorizer(size=100, alternate_sign=False)
+        a, b = hv.transform([{'color=red': 2.5}, 'color=red size=big'])
+        red, big = hv.hash(['color=red', 'size=big'])[0]
+        self.assertEqual(2.5, a[red])
+        self.assertEqual(1, b[red])
+        self.assertEqual(1, b[big])
+
+    def test_analyzer(self):
+        hv = HashingVectorizer(size=100, analyzer=lambda d: d.split(','))
+        self.assertEqual(2, hv.transform(['a,b'])[0].indices.size)
+
+    def test_transform_batch(self):
+        hv = HashingVectorizer(size=50)
+        documents = [['a', 'b'], [], ['c', 'a', 'd', 'e']]
+        batch = hv.transform_batch(documents)
+        self.assertTrue(isinstance(batch, SparseVectorBatch))
+        self.assertEqual(3, len(batch))
+        for document, sv in zip(documents, batch):
+            alone, = hv.transform([document])
+            self.assertEqual(list(alone.densify()), list(sv.densify()))
+            self.assertEqual(sorted(sv.indices), list(sv.indices))
+        self.assertEqual(0, batch[1].indices.size)
+
+    def test_empty_batch(self):
+        batch = HashingVectorizer(size=10).transform_batch([[], []])
+        self.assertEqual(2, len(batch))
+        self.assertEqual(0, batch.nnz)
+
+
+class TestSparseVectorBatch(unittest.TestCase):
+
+    def test_from_vectors(self):
+        vectors = [SparseVector({1: 2}), SparseVector(3),
+                   SparseVector([4, 0, 5])]
+        batch = SparseVectorBatch.from_vectors(vectors)
+        self.assertEqual(3, len(batch))
+        self.assertEqual(4, batch.nnz)
+        self.assertEqual([[0, 2, 0], [0, 0, 0], [4, 0, 5]],
+                         [list(v) for v in batch])
+        self.assertEqual([4, 0, 5], batch[-1])
+        self.assertRaises(IndexError, batch.__getitem__, 3)
+
+    def test_matmul(self):
+        W = numpy.random.RandomState(0).rand(3, 4)
+        for default in [0, 2]:
+            vectors = [SparseVector({1: 2}, default_value=default, size=3),
+                       SparseVector(3, default_value=default),
+                       SparseVector({0: 4, 2: 5}, default_value=default)]
+            batch = SparseVectorBatch.from_vectors(vectors)
+            dense = numpy.array([v.densify() for v in vectors])
+            numpy.testing.assert_allclose(numpy.dot(dense, W),
+                                          batch.matmul(W, workers=2))
+            numpy.testing.assert_allclose(
+                numpy.dot(dense, W[:, :3].T),
+                dot_sparse(W[:, :3], batch, workers=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
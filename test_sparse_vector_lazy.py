@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy
+import sparse_vector
+from sparse_vector import SparseVector
+from sparse_vector_lazy import Expression, lazy, where
+
+
+class TestLazyExpressions(unittest.TestCase):
+
+    def setUp(self):
+        self.a = SparseVector({1: 2., 4: -3., 7: 1.}, size=10)
+        self.w = SparseVector({1: 3., 5: 2.}, size=10, default_value=1.)
+        self.b = SparseVector({4: 1., 9: 5.}, size=10)
+
+    def assertComputes(self, expected, expression):
+        self.assertTrue(isinstance(expression, Expression))
+        result = expression.compute()
+        self.assertTrue(isinstance(result, SparseVector))
+        numpy.testing.assert_array_almost_equal(expected, result.densify())
+
+    def test_arithmetic(self):
+        a, w, b = self.a.densify(), self.w.densify(), self.b.densify()
+        self.assertComputes(a * w + b, self.a.lazy() * self.w + self.b)
+        self.assertComputes(2 - a / 4., 2 - self.a.lazy() / 4.)
+        self.assertComputes(-abs(a) ** 2, -abs(self.a.lazy()) ** 2)
+
+    def test_result_stays_sparse(self):
+        result = (self.a.lazy() * self.w + self.b).compute()
+        self.assertEqual(0, result.default)
+        self.assertEqual([1, 4, 7, 9], list(result.indices))
+
+    def test_result_default(self):
+        result = (self.a.lazy() + 1).compute()
+        self.assertEqual(1, result.default)
+        self.assertEqual([1, 4, 7], list(result.indices))
+
+    def test_sparse_vector_on_the_left(self):
+        a, w = self.a.densify(), self.w.densify()
+        self.assertComputes(w + a, self.w + self.a.lazy())
+        self.assertComputes(w * a, self.w * lazy(self.a))
+
+    def test_ufuncs_clip_and_masks(self):
+        a, b = self.a.densify(), self.b.densify()
+        self.assertComputes(numpy.exp(a), numpy.exp(self.a.lazy()))
+        self.assertComputes(numpy.maximum(a, b),
+                            numpy.maximum(self.a.lazy(), self.b))
+        self.assertComputes(numpy.clip(a, 0, None), self.a.lazy().clip(0))
+        self.assertComputes(numpy.where(a > 1, a, b),
+                            where(self.a.lazy() > 1, self.a, self.b))
+        self.assertComputes(numpy.where(b > 0, 0, a),
+                            self.a.lazy().mask(self.b.lazy() > 0))
+
+    def test_leaves_are_never_written(self):
+        before = self.a.densify()
+        for func in [lambda x: x, numpy.asarray, lambda x: x.view()]:
+            self.assertComputes(before + 1, self.a.lazy().apply(func) + 1)
+        numpy.testing.assert_array_equal(before, self.a.densify())
+
+    def test_same_vector_twice(self):
+        a = self.a.densify()
+        self.assertComputes(a * a + a, self.a.lazy() * self.a + self.a)
+
+    def test_reductions(self):
+        a, w, b = self.a.densify(), self.w.densify(), self.b.densify()
+        expression = (self.a.lazy() * self.w + self.b).clip(0)
+        expected = numpy.clip(a * w + b, 0, None)
+        self.assertAlmostEqual(expected.dot(b), expression.dot(self.b))
+        self.assertAlmostEqual(expected.sum(), expression.sum())
+        self.assertAlmostEqual(expected.mean(), expression.mean())
+        self.assertAlmostEqual(expected.max(), expression.max())
+        self.assertAlmostEqual(numpy.linalg.norm(expected),
+                               expression.norm())
+
+    def test_element_access_does_not_compute(self):
+        expression = self.a.lazy() * self.w + self.b
+        with sparse_vector.track() as counts:
+            self.assertEqual(2. * 3., expression[1])
+            self.assertEqual(-3. + 1., expression[4])
+            self.assertEqual(0., expression[-1] - 5.)
+        self.assertEqual(0, counts['densify_calls'])
+        self.assertRaises(IndexError, expression.__getitem__, 10)
+
+    def test_sizes_must_match(self):
+        expression = self.a.lazy() + SparseVector(3)
+        self.assertRaises(AssertionError, expression.compute)
+
+    def test_dense_operands_are_refused(self):
+        self.assertRaises(TypeError, lambda: self.a.lazy() + numpy.ones(10))
+
+    def test_repr(self):
+        self.assertTrue(repr(self.a.lazy() + 1).startswith('add('))
+
+
+class TestReductions(unittest.TestCase):
+
+    def test_sum_max_min_norm(self):
+        sv = SparseVector({1: 2., 3: -4.}, size=5, default_value=1.)
+        dense = sv.densify()
+        self.assertEqual(dense.sum(), sv.sum())
+        self.assertEqual(2., sv.max())
+        self.assertEqual(-4., sv.min())
+        self.assertAlmostEqual(numpy.linalg.norm(dense), sv.norm())
+        self.assertEqual(1., SparseVector({0: 0.5}, size=2,
+                                          default_value=1.).max())
+        self.assertRaises(ValueError, SparseVector(0).max)
+
+    def test_dot_sparse(self):
+        a = SparseVector({1: 2., 3: -4., 8: 1.}, size=10)
+        b = SparseVector({3: 3., 4: 5.}, size=10, default_value=2.)
+        self.assertAlmostEqual(a.densify().dot(b.densify()), a.dot(b))
+        self.assertAlmostEqual(a.densify().dot(b.densify()), b.dot(a))
+        self.assertAlmostEqual(b.densify().dot(b.densify()), b.dot(b))
+
+    def test_dot_dense(self):
+        a = SparseVector({1: 2., 3: -4.}, size=5, default_value=.5)
+        q = numpy.arange(5.)
+        self.assertAlmostEqual(a.densify().dot(q), a.dot(q))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+import numpy
+from sparse_vector import SparseVector
+from sparse_vector_shared import SharedSparseVector
+
+
+class TestSharedSparseVector(unittest.TestCase):
+
+    def test_snapshots_do_not_change(self):
+        shared = SharedSparseVector(SparseVector({1: 2., 3: 4.}, size=5))
+        before = shared.snapshot()
+        shared[1] = 7.
+        shared[2] = 1.
+        del shared[3]
+        self.assertEqual([0, 2., 0, 4., 0], list(before.vector()))
+        self.assertEqual([0, 7., 1., 0, 0], list(shared))
+        self.assertEqual(0, before.version)
+        self.assertEqual(3, shared.version)
+        self.assertEqual(4., before[3])
+        self.assertEqual(0., before[-1])
+        self.assertRaises(IndexError, before.__getitem__, 5)
+
+    def test_snapshot_arrays_are_read_only(self):
+        sv = SparseVector({1: 2.}, size=3)
+        shared = SharedSparseVector(sv)
+        snapshot = shared.snapshot()
+        self.assertFalse(snapshot.values.flags.writeable)
+        self.assertRaises(ValueError, snapshot.values.__setitem__, 0, 1.)
+        sv[1] = 5.  # the vector it was made of remains writable
+        self.assertEqual(2., shared[1])
+
+    def test_batch_publishes_once(self):
+        shared = SharedSparseVector(10)
+        snapshot = shared.snapshot()
+        with shared.batch() as sv:
+            for i in range(0, 10, 2):
+                sv[i] = i
+            self.assertTrue(shared.snapshot() is snapshot)
+        self.assertEqual(1, shared.version)
+        self.assertEqual([0, 2, 4, 6, 8], list(shared.snapshot().indices))
+        self.assertEqual(8, shared[8])
+
+    def test_writer_vector_is_detached_once_published(self):
+        shared = SharedSparseVector(4)
+        with shared.batch() as sv:
+            sv[2] = 5.
+        sv[2] = 99.
+        sv[[0, 2]] = [7., 98.]
+        self.assertEqual(5., shared[2])
+        self.assertEqual([5.], list(shared.snapshot().values))
+
+    def test_failed_batch_publishes_nothing(self):
+        shared = SharedSparseVector(3)
+        try:
+            with shared.batch() as sv:
+                sv[0] = 1
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(0, shared.version)
+        self.assertEqual(0, shared[0])
+
+    def test_readers_see_consistent_snapshots(self):
+        shared = SharedSparseVector(100)
+        errors = []
+
+        def write():
+            for n in range(1, 50):
+                with shared.batch() as sv:
+                    sv[numpy.arange(100)] = n
+
+        def read():
+            for _ in range(200):
+                values = shared.snapshot().vector().densify()
+                if len(set(values)) != 1:
+                    errors.append(values)
+
+        threads = [threading.Thread(target=write)] + \
+            [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(49, shared[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
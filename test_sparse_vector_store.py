@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from sparse_vector import SparseVector
+from sparse_vector_store import SparseVectorStore
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+
+class TestSparseVectorStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'vectors.svr')
+        self.store = SparseVectorStore(self.path)
+        self.vectors = {
+            u'a': SparseVector({1: 2., 5: 3.}, size=8),
+            u'b': SparseVector({0: 1}, default_value=-1, size=3,
+                               dtype=numpy.int32),
+            u'c': SparseVector(4),
+        }
+        for key, sv in self.vectors.items():
+            self.store[key] = sv
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def assertSame(self, expected, sv):
+        self.assertEqual(len(expected), len(sv))
+        self.assertEqual(list(expected), list(sv))
+
+    def test_round_trip(self):
+        self.assertEqual(3, len(self.store))
+        for key, sv in self.vectors.items():
+            self.assertSame(sv, self.store[key])
+        self.assertEqual(numpy.int32, self.store[u'b'].values.dtype)
+        self.assertEqual(-1, self.store[u'b'].default)
+        self.assertRaises(KeyError, self.store.__getitem__, u'd')
+        self.assertRaises(TypeError, self.store.__setitem__, 1,
+                          SparseVector(1))
+
+    def test_vectors_are_mapped_and_copied_on_write(self):
+        sv = self.store[u'a']
+        self.assertFalse(sv.values.flags.owndata)
+        sv[1] = 7.
+        sv[2] = 8.
+        self.assertEqual(7., sv[1])
+        self.assertEqual(2., self.store[u'a'][1])
+
+    def test_reopen(self):
+        self.store[u'a'] = SparseVector({2: 9.}, size=3)
+        del self.store[u'c']
+        self.store.close()
+        self.store = SparseVectorStore(self.path)
+        self.assertEqual([u'a', u'b'], sorted(self.store))
+        self.assertSame([0, 0, 9.], self.store[u'a'])
+        self.assertTrue(self.store.garbage > 0)
+
+    def test_reopen_torn_file(self):
+        intact = self.store.nbytes
+        self.store[u'd'] = SparseVector({3: 4.}, size=5)
+        whole = self.store.nbytes
+        self.store.close()
+        for torn in (whole - 5, intact + 10):
+            with open(self.path, 'r+b') as f:
+                f.truncate(torn)
+            self.store = SparseVectorStore(self.path)
+            self.assertEqual([u'a', u'b', u'c'], sorted(self.store.keys()))
+            self.assertEqual(intact, self.store.nbytes)
+            self.store[u'd'] = SparseVector({3: 4.}, size=5)
+            self.assertSame([0, 0, 0, 4., 0], self.store[u'd'])
+            self.store.close()
+        self.store = SparseVectorStore(self.path)
+        self.assertSame([0, 0, 0, 4., 0], self.store[u'd'])
+
+    def test_compact(self):
+        self.store[u'a'] = SparseVector({2: 9.}, size=3)
+        del self.store[u'c']
+        kept = self.store[u'b']
+        before = self.store.nbytes
+        self.store.compact(background=True).join()
+        self.assertEqual(0, self.store.garbage)
+        self.assertTrue(self.store.nbytes < before)
+        self.assertSame([0, 0, 9.], self.store[u'a'])
+        self.assertSame(self.vectors[u'b'], kept)
+        self.assertFalse(u'c' in self.store)
+
+    def test_load_many_and_batches(self):
+        keys = [u'c', u'a', u'b', u'a']
+        loaded = self.store.load_many(keys)
+        for key, sv in zip(keys, loaded):
+            self.assertSame(self.vectors[key], sv)
+        self.assertEqual(1, self.store.prefetch(keys))
+        batches = list(self.store.iter_batches(keys, batch_size=3))
+        self.assertEqual([3, 1], [len(b) for b in batches])
+        self.assertSame(self.vectors[u'a'], batches[1][0])
+
+    @unittest.skipIf(asyncio is None, "asyncio is not available")
+    def test_async_loading(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        batches = []
+        iterator = self.store.aiter_batches([u'a', u'b', u'c'], batch_size=2)
+        self.assertTrue(iterator.__aiter__() is iterator)
+        while True:
+            try:
+                batches.append(loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        gathered = loop.run_until_complete(asyncio.gather(
+            self.store.load_async([u'b']), self.store.load_async([u'c'])))
+        asyncio.set_event_loop(None)
+        loop.close()
+        self.assertEqual([2, 1], [len(b) for b in batches])
+        self.assertSame(self.vectors[u'c'], batches[1][0])
+        self.assertSame(self.vectors[u'b'], gathered[0][0])
+
+if __name__ == '__main__':
+    unittest.main()